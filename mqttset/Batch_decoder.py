@@ -0,0 +1,260 @@
+import mmap
+import os
+
+import numpy as np
+
+from Layered_features import ETHERNET_TYPES, IP_PROTOCOLS, TRANSPORTS, PORTS, PORT_PAIRS, N_COLUMNS, \
+    IP_PROTO_TCP, IP_PROTO_UDP
+from Pcap_index import Pcap_index, read_file_header, FILE_HEADER_LEN, RECORD_HEADER_LEN
+from Pcap_ingestion import Pcap_ingestion, decode_ethernet, file_format
+from Row_buffer import Row_buffer
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_ARP = 0x0806
+ETH_HEADER_LEN = 14
+# vlan tagged (802.1Q, QinQ) and MPLS frames: dpkt unpacks their tags itself and fails on truncated ones
+TAGGED_ETH_TYPES = (0x8100, 0x88a8, 0x9100, 0x9200, 0x8847, 0x8848)
+# ip protocols whose packets are decoded by the batch decoder, the others go through dpkt
+BATCH_PROTOCOLS = (1, 2, IP_PROTO_TCP, IP_PROTO_UDP)
+# ethernet/ipv4/tcp/udp header fields of a batch of records
+HEADER_DTYPE = np.dtype([('caplen', np.int64), ('eth_type', np.uint16), ('ihl', np.uint8), ('ttl', np.uint8),
+                         ('proto', np.uint8), ('frag_offset', np.uint16), ('ip_len', np.uint16),
+                         ('sport', np.uint16), ('dport', np.uint16), ('tcp_off', np.uint8), ('tcp_flags', np.uint8),
+                         ('l4_len', np.int64)])
+# record kinds
+DISCARDED, BATCH, FALLBACK = 0, 1, 2
+# TCP flag bit of every flag column
+FLAG_BITS = {"fin_flag_number": 0x01, "syn_flag_number": 0x02, "rst_flag_number": 0x04, "psh_flag_number": 0x08,
+             "ack_flag_number": 0x10, "ece_flag_number": 0x40, "cwr_flag_number": 0x80,
+             "ack_count": 0x10, "syn_count": 0x02, "fin_count": 0x01, "rst_count": 0x04}
+
+
+class Record_bytes:
+    """
+    reads bytes at fixed offsets of every record of a batch, straight from the mmap'd file; bytes
+    beyond the captured length of a record read as 0
+    """
+    def __init__(self, data, starts, caplen):
+        self.data = data
+        self.starts = starts
+        self.caplen = caplen
+        self.last = len(data) - 1
+
+    def u8(self, pos):
+        valid = pos < self.caplen
+        values = self.data[np.minimum(self.starts + pos, self.last)]
+        return np.where(valid, values, 0).astype(np.uint16)
+
+    def u16(self, pos):
+        return self.u8(pos) << 8 | self.u8(pos + 1)
+
+
+def read_headers(data, starts, caplen):
+    """
+    extracts the fixed-offset Ethernet/IPv4/TCP/UDP header fields of the records starting at starts
+    :return: structured array of HEADER_DTYPE
+    """
+    raw = Record_bytes(data, starts, caplen)
+    headers = np.zeros(len(starts), dtype=HEADER_DTYPE)
+    headers['caplen'] = caplen
+    headers['eth_type'] = raw.u16(12)
+    version_ihl = raw.u8(ETH_HEADER_LEN)
+    headers['ihl'] = version_ihl & 0x0f
+    headers['ip_len'] = raw.u16(ETH_HEADER_LEN + 2)
+    headers['frag_offset'] = raw.u16(ETH_HEADER_LEN + 6) & 0x1fff
+    headers['ttl'] = raw.u8(ETH_HEADER_LEN + 8)
+    headers['proto'] = raw.u8(ETH_HEADER_LEN + 9)
+    l4 = ETH_HEADER_LEN + 4 * headers['ihl'].astype(np.int64)
+    # as dpkt: the ip payload ends at the ip total length (if it is set), within the captured bytes
+    ip_end = np.where(headers['ip_len'] > 0, ETH_HEADER_LEN + headers['ip_len'].astype(np.int64), caplen)
+    headers['l4_len'] = np.maximum(np.minimum(ip_end, caplen) - l4, 0)
+    headers['sport'] = raw.u16(l4)
+    headers['dport'] = raw.u16(l4 + 2)
+    headers['tcp_off'] = raw.u8(l4 + 12) >> 4
+    headers['tcp_flags'] = raw.u8(l4 + 13)
+    return headers
+
+
+def classify_records(headers):
+    """
+    DISCARDED for the records the extractor drops (not decodable as Ethernet, or neither IPv4 nor ARP),
+    BATCH for plain IPv4 (ICMP/IGMP/TCP/UDP) and ARP frames, FALLBACK for everything else (802.3/LLC
+    frames, truncated or unusual IPv4 headers, other ip protocols), which goes through dpkt
+    """
+    eth_type = headers['eth_type']
+    caplen = headers['caplen']
+    kind = np.full(len(headers), DISCARDED, dtype=np.uint8)
+    ethernet = caplen >= ETH_HEADER_LEN
+    kind[ethernet & (eth_type <= 1500)] = FALLBACK  # 802.3 frames, possibly ISL tagged IPv4
+    kind[ethernet & (eth_type == ETH_TYPE_ARP)] = BATCH
+    ip = ethernet & (eth_type == ETH_TYPE_IP)
+    plain_ip = ip & (caplen >= ETH_HEADER_LEN + 20) & (headers['ihl'] >= 5) & np.isin(headers['proto'], BATCH_PROTOCOLS)
+    kind[ip] = FALLBACK
+    kind[plain_ip] = BATCH
+    return kind
+
+
+def port_table(ports):
+    table = np.zeros(65536, dtype=np.uint32)
+    for port, bits in ports.items():
+        table[port] = bits
+    return table
+
+
+def indicator_masks(headers, tcp, udp, classify):
+    """
+    vectorized Layered_features.classify of a batch (the ethernet type bits always, the others if classify)
+    """
+    masks = np.zeros(len(headers), dtype=np.uint32)
+    for eth_type, bits in ETHERNET_TYPES.items():
+        masks[headers['eth_type'] == eth_type] = bits
+    if not classify:
+        return masks
+    ip = headers['eth_type'] == ETH_TYPE_IP
+    for proto, bits in IP_PROTOCOLS.items():
+        masks[ip & (headers['proto'] == proto)] |= bits
+    sport, dport = headers['sport'], headers['dport']
+    for proto, transport in ((IP_PROTO_TCP, tcp), (IP_PROTO_UDP, udp)):
+        ports = port_table(PORTS[proto])
+        masks[transport] |= TRANSPORTS[proto] | ports[sport[transport]] | ports[dport[transport]]
+        for (src_port, dst_port), bits in PORT_PAIRS[proto].items():
+            masks[transport & (sport == src_port) & (dport == dst_port)] |= bits
+    return masks
+
+
+def batch_rows(extractor, headers, ts):
+    """
+    the per-packet rows (in the columns of the extractor) of BATCH records, without IAT
+    """
+    rows = np.zeros(len(headers), dtype=np.dtype(list(extractor.column_dtypes.items())))
+    ip = headers['eth_type'] == ETH_TYPE_IP
+    unfragmented = ip & (headers['frag_offset'] == 0)
+    tcp = unfragmented & (headers['proto'] == IP_PROTO_TCP) & (headers['l4_len'] >= 20) & (headers['tcp_off'] >= 5)
+    udp = unfragmented & (headers['proto'] == IP_PROTO_UDP) & (headers['l4_len'] >= 8)
+
+    rows['ts'] = ts
+    # as dpkt: the tcp options are cut at the end of the ip payload
+    tcp_header_len = 20 + np.minimum(4 * headers['tcp_off'].astype(np.int64) - 20, headers['l4_len'] - 20)
+    rows['Header_Length'] = np.where(tcp, tcp_header_len, np.where(udp, 8, 0))
+    rows['Protocol Type'] = np.where(ip, headers['proto'], 0)
+    rows['Time_To_Live'] = np.where(ip, headers['ttl'], 0)
+    if "flags" in extractor.stages:
+        flags = np.where(tcp, headers['tcp_flags'], 0)
+        for column, bit in FLAG_BITS.items():
+            rows[column] = (flags & bit) != 0
+    masks = indicator_masks(headers, tcp, udp, "indicators" in extractor.stages)
+    for n, column in enumerate(extractor.columns[16:16 + N_COLUMNS]):
+        rows[column] = (masks >> n) & 1
+    rows['Tot size'] = headers['caplen']
+    rows['Number'] = 1
+    return rows
+
+
+def supports(extractor):
+    """
+    the batch decoder computes the columns that need no per-flow or per-endpoint state
+    """
+    return not extractor.extra_columns and extractor.stages <= {"flags", "indicators"}
+
+
+def packet_rows(extractor, pcap_file, byte_range=None, time_range=None, record_offsets=None, report=None):
+    """
+    Per-packet rows of the records of pcap_file (or of the given range/records of it), decoded in batch
+    from the mmap'd file; the records the batch decoder does not handle are decoded by dpkt and
+    processed by extractor.process_packet. The extractor must be reset. report (Extraction_report, opt-in)
+    gets the packet counters of Feature_extraction.read_packets.
+    :return: record numbers (in the file) and Row_buffer of the rows, or None if the file needs the
+             dpkt engine (pcapng or compressed, nanosecond timestamps, non-Ethernet link type, truncated file)
+    """
+    if not supports(extractor) or not isinstance(pcap_file, (str, os.PathLike)) or file_format(pcap_file) != 'pcap':
+        return None
+    index = Pcap_index.load(pcap_file)
+    size = os.path.getsize(pcap_file)
+    end = index.record_range(0, len(index))[1] if len(index) else FILE_HEADER_LEN
+    if size < FILE_HEADER_LEN or end != size:
+        return None
+    with open(pcap_file, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            _, divisor, _, linktype = read_file_header(mm)
+            if divisor != 1E6 or Pcap_ingestion(pcap_file).get_decoder(linktype) is not decode_ethernet:
+                return None
+            records = select_records(index, byte_range, time_range, record_offsets)
+            if records is None:
+                return None
+            starts = index.offsets[records].astype(np.int64) + RECORD_HEADER_LEN
+            caplen = index.caplen[records].astype(np.int64)
+            data = np.frombuffer(mm, dtype=np.uint8)
+            headers = read_headers(data, starts, caplen)
+            del data  # the mmap can only be closed without views on it
+            if report is not None:
+                report.count(f"linktype_{linktype}", len(records))
+            return decode_records(extractor, mm, headers, starts, index.ts[records], records, report)
+
+
+def select_records(index, byte_range, time_range, record_offsets):
+    """
+    record numbers of the byte range / time range / record offsets, as Pcap_ingestion reads them
+    """
+    if record_offsets is not None:
+        offsets = np.asarray(record_offsets, dtype=np.uint64)
+        records = np.searchsorted(index.offsets, offsets)
+        if np.any(records >= len(index)) or np.any(index.offsets[np.minimum(records, len(index) - 1)] != offsets):
+            return None  # not at a record boundary
+        return records
+    if byte_range is None and time_range is not None:
+        byte_range = index.time_range(*time_range)
+    records = np.arange(len(index))
+    if byte_range is not None:
+        start, end = byte_range
+        records = records[(index.offsets >= start) & (index.offsets < end)] if start < end else records[:0]
+    if time_range is not None:
+        ts = index.ts[records]
+        records = records[(ts >= time_range[0]) & (ts < time_range[1])]
+    return records
+
+
+def decode_records(extractor, mm, headers, starts, ts, records, report=None):
+    """
+    rows of the records from their headers, the FALLBACK records decoded by dpkt from mm
+    """
+    caplen = headers['caplen']
+    kind = classify_records(headers)
+
+    fallback_rows = {}
+    decoded = caplen >= ETH_HEADER_LEN  # as dpkt, which needs the 14 bytes of the Ethernet header
+    for n in np.flatnonzero(kind == FALLBACK).tolist():
+        buf = mm[starts[n]:starts[n] + caplen[n]]
+        eth = decode_ethernet(buf)
+        if eth is None:
+            decoded[n] = False
+        row = extractor.process_packet(float(ts[n]), buf, eth)
+        if row is not None:
+            fallback_rows[n] = row
+    kept = kind == BATCH
+    kept[list(fallback_rows)] = True
+
+    positions = np.flatnonzero(kept)
+    if report is not None:
+        # the discarded tagged frames are decoded by dpkt only to count the ones it cannot decode
+        tagged = decoded & (kind == DISCARDED) & np.isin(headers['eth_type'], TAGGED_ETH_TYPES)
+        for n in np.flatnonzero(tagged).tolist():
+            decoded[n] = decode_ethernet(mm[starts[n]:starts[n] + caplen[n]]) is not None
+        counters = {"packets": len(headers), "fallback": int(np.count_nonzero(kind == FALLBACK)),
+                    "undecoded": len(headers) - int(np.count_nonzero(decoded)), "discarded": len(headers) - len(positions)}
+        eth_types, counts = np.unique(headers['eth_type'][decoded], return_counts=True)
+        counters.update((f"eth_type_{eth_type:#06x}", n) for eth_type, n in zip(eth_types.tolist(), counts.tolist()))
+        for name, n in counters.items():
+            if n:
+                report.count(name, n)
+    buffer = Row_buffer(extractor.column_dtypes, capacity=len(positions))
+    rows = buffer.data
+    batch = kind[positions] == BATCH
+    rows[batch] = batch_rows(extractor, headers[positions[batch]], ts[positions[batch]])
+    for n, row in zip(np.flatnonzero(~batch).tolist(), fallback_rows.values()):
+        rows[n] = row
+    # inter arrival time to the previous kept packet, 0 for the first one (as process_packet)
+    kept_ts = rows['ts']
+    previous = np.concatenate([[0.0], kept_ts[:-1]])
+    rows['IAT'] = np.where(previous == 0, 0.0, kept_ts - previous)
+    buffer.size = len(positions)
+    return records[positions], buffer
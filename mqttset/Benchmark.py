@@ -0,0 +1,197 @@
+import json
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import struct
+import tempfile
+
+import dpkt
+
+from Feature_extraction import Feature_extraction
+from Instrumentation import Extraction_report
+
+# default protocol mix of the synthetic traffic (shares of the packets)
+DEFAULT_MIX = {"mqtt": 0.4, "tcp": 0.25, "udp": 0.2, "arp": 0.05, "icmp": 0.1}
+PATTERNS = ["mixed", "syn_flood", "spoofed", "long_sessions"]
+MAC_A, MAC_B, MAC_BROADCAST = b'\x02\x00\x00\x00\x00\x01', b'\x02\x00\x00\x00\x00\x02', b'\xff' * 6
+
+
+def random_ip(rnd):
+    return struct.pack('!I', rnd.randint(0x0a000001, 0x0affffff))
+
+
+def ethernet_ip(src, dst, proto, l4, ttl=64):
+    ip = dpkt.ip.IP(src=src, dst=dst, p=proto, ttl=ttl, data=l4)
+    ip.len = len(ip.pack_hdr()) + len(bytes(l4))
+    return dpkt.ethernet.Ethernet(src=MAC_A, dst=MAC_B, type=dpkt.ethernet.ETH_TYPE_IP, data=ip)
+
+
+def make_flows(rnd, n_flows, mix):
+    """
+    n_flows random (protocol, client ip, client port, server ip, server port) flows, protocols drawn from mix
+    """
+    protocols = list(mix)
+    weights = [mix[p] for p in protocols]
+    servers = [random_ip(rnd) for _ in range(max(1, n_flows // 20))]
+    flows = []
+    for _ in range(n_flows):
+        protocol = rnd.choices(protocols, weights)[0]
+        server_port = {"mqtt": 1883, "tcp": rnd.choice([80, 443, 22, 23, 25]),
+                       "udp": rnd.choice([53, 5683, 67])}.get(protocol, 0)
+        flows.append((protocol, random_ip(rnd), rnd.randint(1024, 65535), rnd.choice(servers), server_port))
+    return flows
+
+
+def make_packet(rnd, flow, reply=False, tcp_flags=dpkt.tcp.TH_ACK | dpkt.tcp.TH_PUSH, payload=None):
+    protocol, client, client_port, server, server_port = flow
+    src, dst, sport, dport = (server, client, server_port, client_port) if reply else \
+        (client, server, client_port, server_port)
+    if payload is None:
+        payload = b'\x30' * rnd.randint(0, 300)
+    if protocol == "arp":
+        arp = dpkt.arp.ARP(sha=MAC_A, spa=src, tha=b'\x00' * 6, tpa=dst)
+        return dpkt.ethernet.Ethernet(src=MAC_A, dst=MAC_BROADCAST, type=dpkt.ethernet.ETH_TYPE_ARP, data=arp)
+    if protocol == "icmp":
+        icmp = dpkt.icmp.ICMP(type=0 if reply else 8, data=dpkt.icmp.ICMP.Echo(id=client_port, data=payload[:56]))
+        return ethernet_ip(src, dst, dpkt.ip.IP_PROTO_ICMP, icmp)
+    if protocol == "udp":
+        udp = dpkt.udp.UDP(sport=sport, dport=dport, data=payload)
+        udp.ulen = len(udp)
+        return ethernet_ip(src, dst, dpkt.ip.IP_PROTO_UDP, udp)
+    tcp = dpkt.tcp.TCP(sport=sport, dport=dport, flags=tcp_flags, seq=rnd.getrandbits(32), data=payload)
+    return ethernet_ip(src, dst, dpkt.ip.IP_PROTO_TCP, tcp)
+
+
+def synthetic_packets(n_packets, n_flows=1000, mix=None, pattern="mixed", seed=0):
+    """
+    yields (ts, ethernet frame) of synthetic traffic:
+    mixed: packets of n_flows flows of the protocol mix, in both directions,
+    syn_flood: mixed traffic with 80% TCP SYNs from random source ports to one MQTT broker,
+    spoofed: mixed traffic with 80% packets from a new random source address each,
+    long_sessions: a few (n_flows / 100) long TCP/MQTT sessions, each closed by a FIN at the end
+    """
+    if pattern not in PATTERNS:
+        raise ValueError(f"unknown pattern {pattern!r}, expected one of {PATTERNS}")
+    rnd = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    if pattern == "long_sessions":
+        mix = {"mqtt": 0.5, "tcp": 0.5}
+        n_flows = max(1, n_flows // 100)
+    flows = make_flows(rnd, n_flows, mix)
+    broker = random_ip(rnd)
+    ts = 1700000000.0
+    for n in range(n_packets):
+        ts = ts + rnd.expovariate(1000.0)
+        attack = pattern in ("syn_flood", "spoofed") and rnd.random() < 0.8
+        if attack and pattern == "syn_flood":
+            flow = ("mqtt", flows[0][1], rnd.randint(1024, 65535), broker, 1883)
+            frame = make_packet(rnd, flow, tcp_flags=dpkt.tcp.TH_SYN, payload=b'')
+        elif attack:
+            protocol = rnd.choice(["tcp", "udp"])
+            flow = (protocol, random_ip(rnd), rnd.randint(1024, 65535), broker, 1883 if protocol == "tcp" else 5683)
+            frame = make_packet(rnd, flow, tcp_flags=dpkt.tcp.TH_SYN)
+        elif pattern == "long_sessions":
+            last = n >= n_packets - len(flows)  # the last packet of every session closes it
+            flow = flows[n % len(flows)] if last else rnd.choice(flows)
+            flags = dpkt.tcp.TH_FIN | dpkt.tcp.TH_ACK if last else dpkt.tcp.TH_ACK | dpkt.tcp.TH_PUSH
+            frame = make_packet(rnd, flow, reply=rnd.random() < 0.5, tcp_flags=flags)
+        else:
+            frame = make_packet(rnd, rnd.choice(flows), reply=rnd.random() < 0.5)
+        yield ts, bytes(frame)
+
+
+def write_synthetic_pcap(pcap_file, n_packets, n_flows=1000, mix=None, pattern="mixed", seed=0):
+    """
+    writes a synthetic Ethernet pcap file (see synthetic_packets)
+    """
+    with open(pcap_file, 'wb') as f:
+        writer = dpkt.pcap.Writer(f, linktype=dpkt.pcap.DLT_EN10MB)
+        for ts, frame in synthetic_packets(n_packets, n_flows, mix, pattern, seed):
+            writer.writepkt(frame, ts=ts)
+
+
+def run_extraction(pcap_file, output_stem, features=None):
+    """
+    runs Feature_extraction.pcap_evaluation with an Extraction_report
+    :return: dict with the packets, rows, per-stage seconds, counters and the peak RSS (MB) of the process
+    """
+    report = Extraction_report()
+    rows = Feature_extraction(features=features).pcap_evaluation(pcap_file, output_stem, report=report)
+    result = report.to_dict()
+    packets = report.counters["packets"]
+    total = sum(report.times.values())
+    result.update({"packets": packets, "rows": rows, "seconds": total,
+                   "packets_per_second": packets / total if total else 0.0,
+                   # ru_maxrss is in KB on Linux
+                   "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024})
+    return result
+
+
+def benchmark(pcap_file, repeat=3, features=None):
+    """
+    extracts pcap_file repeat times, every run in a fresh process so that its peak RSS is its own
+    :return: the results of the runs and the best run (highest packets per second)
+    """
+    context = multiprocessing.get_context('spawn')
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in range(repeat):
+            with context.Pool(1) as pool:
+                runs.append(pool.apply(run_extraction, (pcap_file, os.path.join(tmp, f"run_{n}"), features)))
+    best = max(runs, key=lambda run: run["packets_per_second"])
+    return {"pcap_file": pcap_file, "pcap_bytes": os.path.getsize(pcap_file), "runs": runs, "best": best}
+
+
+def parse_mix(text):
+    """
+    'mqtt=0.5,udp=0.3,arp=0.2' -> {'mqtt': 0.5, 'udp': 0.3, 'arp': 0.2}
+    """
+    mix = {}
+    for part in text.split(','):
+        protocol, share = part.split('=')
+        if protocol not in DEFAULT_MIX:
+            raise ValueError(f"unknown protocol {protocol!r}, expected some of {list(DEFAULT_MIX)}")
+        mix[protocol] = float(share)
+    return mix
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(
+        description="Extraction benchmark: generates synthetic pcaps and reports packets/s, peak RSS and the time "
+                    "of every stage as JSON."
+    )
+    parser.add_argument("--packets", type=int, default=100000, help="packets per synthetic pcap (default: 100000)")
+    parser.add_argument("--flows", type=int, default=1000, help="number of flows (default: 1000)")
+    parser.add_argument("--mix", type=parse_mix, default=None,
+                        help="protocol mix, e.g. mqtt=0.4,tcp=0.25,udp=0.2,arp=0.05,icmp=0.1 (the default)")
+    parser.add_argument("--pattern", nargs="+", choices=PATTERNS, default=["mixed"],
+                        help="traffic patterns to benchmark, one pcap each (default: mixed)")
+    parser.add_argument("--pcap", nargs="*", default=[], help="existing pcap files to benchmark as well")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per pcap, the best one is reported (default: 3)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--features", nargs="+", default=None, help="columns to extract (default: all)")
+    parser.add_argument("--output", "-o", default="-", help="json file to write the results to ('-' for stdout)")
+    args = parser.parse_args()
+
+    results = {"python": sys.version.split()[0], "dpkt": dpkt.__version__, "host": socket.gethostname(),
+               "features": args.features, "benchmarks": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        for pattern in args.pattern:
+            pcap_file = os.path.join(tmp, f"{pattern}.pcap")
+            write_synthetic_pcap(pcap_file, args.packets, args.flows, args.mix, pattern, args.seed)
+            result = benchmark(pcap_file, args.repeat, args.features)
+            result.update({"pcap_file": None, "pattern": pattern, "flows": args.flows, "mix": args.mix or DEFAULT_MIX})
+            results["benchmarks"].append(result)
+        for pcap_file in args.pcap:
+            results["benchmarks"].append(benchmark(pcap_file, args.repeat, args.features))
+
+    text = json.dumps(results, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
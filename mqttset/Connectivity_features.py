@@ -14,6 +14,15 @@ class Connectivity_features_basic:
         except:
             return None
 
+    def get_source_address(self):
+        """
+        raw 4 byte source address, cheaper to hash than its string
+        """
+        return self.packet.src
+
+    def get_destination_address(self):
+        return self.packet.dst
+
     def get_source_port(self):
         return self.packet.data.sport
 
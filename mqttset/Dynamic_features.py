@@ -1,5 +1,6 @@
 import numpy as np
 import itertools
+from collections import deque
 from scipy import stats
 
 class Dynamic_features:
@@ -42,3 +43,81 @@ class Dynamic_features:
 
         return magnite, radius, correlation, covaraince, var_ratio, weight
 
+
+class Two_stream_stats:
+    """
+    Running statistics of two streams of packet lengths (incoming, outgoing), updated in O(1) per packet
+    (Welford's running means and squared deviations). As in Dynamic_features.dynamic_two_streams, the
+    i-th incoming length is paired with the i-th outgoing one (zip) for the correlation and the covariance;
+    the lengths of the longer stream wait in a queue for their pair. values() gives the features of
+    dynamic_two_streams on the lengths added so far.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.n_in, self.n_out = 0, 0
+        self.mean_in, self.mean_out = 0.0, 0.0
+        self.m2_in, self.m2_out = 0.0, 0.0  # sums of squared deviations from the means
+        self.unpaired = deque()  # lengths of the longer stream without a pair yet
+        self.unpaired_outgoing = False  # stream of the unpaired lengths
+        self.pairs = 0
+        self.pair_mean_in, self.pair_mean_out = 0.0, 0.0
+        self.pair_m2_in, self.pair_m2_out = 0.0, 0.0
+        self.co_moment = 0.0  # sum of the products of the deviations of the pairs from the pair means
+
+    def add(self, length, outgoing):
+        """
+        adds the length of a packet to the outgoing stream if outgoing, else to the incoming one
+        """
+        if outgoing:
+            self.n_out = self.n_out + 1
+            delta = length - self.mean_out
+            self.mean_out = self.mean_out + delta / self.n_out
+            self.m2_out = self.m2_out + delta * (length - self.mean_out)
+        else:
+            self.n_in = self.n_in + 1
+            delta = length - self.mean_in
+            self.mean_in = self.mean_in + delta / self.n_in
+            self.m2_in = self.m2_in + delta * (length - self.mean_in)
+        if not self.unpaired or self.unpaired_outgoing == outgoing:
+            self.unpaired.append(length)
+            self.unpaired_outgoing = outgoing
+            return
+        other = self.unpaired.popleft()
+        incoming, outgoing = (other, length) if outgoing else (length, other)
+        self.pairs = self.pairs + 1
+        delta_in = incoming - self.pair_mean_in
+        self.pair_mean_in = self.pair_mean_in + delta_in / self.pairs
+        delta_out = outgoing - self.pair_mean_out
+        self.pair_mean_out = self.pair_mean_out + delta_out / self.pairs
+        self.pair_m2_in = self.pair_m2_in + delta_in * (incoming - self.pair_mean_in)
+        self.pair_m2_out = self.pair_m2_out + delta_out * (outgoing - self.pair_mean_out)
+        self.co_moment = self.co_moment + delta_in * (outgoing - self.pair_mean_out)
+
+    def values(self):
+        """
+        :return: magnitude, radius, correlation, covariance, variance ratio and weight of the two streams
+                 (zeros if they are empty, the mean/variance of an empty stream counts as 0, the correlation
+                 is NaN if a stream of 2 or more paired lengths is constant)
+        """
+        if self.n_in == 0 and self.n_out == 0:
+            return 0, 0, 0, 0, 0, 0
+        magnite = (self.mean_in + self.mean_out) ** 0.5
+        inco_var = self.m2_in / self.n_in if self.n_in else 0.0
+        outgo_var = self.m2_out / self.n_out if self.n_out else 0.0
+        radius = (inco_var + outgo_var) ** 0.5
+        correlation = 0
+        if self.pairs >= 2:
+            denominator = (self.pair_m2_in * self.pair_m2_out) ** 0.5
+            correlation = min(max(self.co_moment / denominator, -1.0), 1.0) if denominator else float('nan')
+        covaraince = 0
+        if self.n_in:
+            # deviations of the pairs from the means of the whole streams
+            covaraince = (self.co_moment + self.pairs * (self.pair_mean_in - self.mean_in) *
+                          (self.pair_mean_out - self.mean_out)) / self.n_in
+        var_ratio = 0
+        if outgo_var != 0:
+            var_ratio = inco_var / outgo_var
+        weight = self.n_in * self.n_out
+        return magnite, radius, correlation, covaraince, var_ratio, weight
@@ -0,0 +1,60 @@
+from array import array
+
+
+class Proto_endpoint_counter:
+    """
+    Counts the packets per (protocol, endpoint), the endpoint being an ip address or a port.
+    Protocol names and endpoints are interned into small integer ids, every (protocol, endpoint)
+    pair gets a slot in a compact array of counts.
+    """
+    def __init__(self):
+        self.protocol_ids = {}  # protocol name -> id
+        self.endpoint_ids = {}  # endpoint -> id
+        self.slots = {}         # endpoint id << 8 | protocol id -> index in counts
+        self.counts = array('Q')
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add(self, protocol, endpoint):
+        """
+        counts one packet
+        :return: the number of packets of (protocol, endpoint) so far
+        """
+        protocol_id = self.protocol_ids.get(protocol)
+        if protocol_id is None:
+            protocol_id = self.protocol_ids[protocol] = len(self.protocol_ids)
+        endpoint_id = self.endpoint_ids.get(endpoint)
+        if endpoint_id is None:
+            endpoint_id = self.endpoint_ids[endpoint] = len(self.endpoint_ids)
+        key = endpoint_id << 8 | protocol_id
+        slot = self.slots.get(key)
+        if slot is None:
+            self.slots[key] = len(self.counts)
+            self.counts.append(1)
+            return 1
+        self.counts[slot] = self.counts[slot] + 1
+        return self.counts[slot]
+
+    def count(self, protocol, endpoint):
+        protocol_id = self.protocol_ids.get(protocol)
+        endpoint_id = self.endpoint_ids.get(endpoint)
+        if protocol_id is None or endpoint_id is None:
+            return 0
+        slot = self.slots.get(endpoint_id << 8 | protocol_id)
+        return 0 if slot is None else self.counts[slot]
+
+    def items(self):
+        """
+        yields (protocol, endpoint, count) of every pair that was counted
+        """
+        protocols = list(self.protocol_ids)
+        endpoints = list(self.endpoint_ids)
+        for key, slot in self.slots.items():
+            yield protocols[key & 0xff], endpoints[key >> 8], self.counts[slot]
+
+    def clear(self):
+        self.protocol_ids.clear()
+        self.endpoint_ids.clear()
+        self.slots.clear()
+        self.counts = array('Q')
@@ -0,0 +1,223 @@
+import os
+import tempfile
+
+import dpkt
+import numpy as np
+import pandas as pd
+
+import Batch_decoder
+from Benchmark import synthetic_packets
+from Feature_extraction import Feature_extraction
+from Instrumentation import Extraction_report
+from Output_writer import read_table
+from Pcap_ingestion import Pcap_ingestion
+
+
+class Engine:
+    """
+    An extraction engine under test. windows(pcap_file, output_stem) returns the summary table of a pcap
+    file (without ts), packets(pcap_file), if given, its per-packet rows with the number of the record
+    they come from in a 'record' column.
+    """
+    def __init__(self, name, windows, packets=None):
+        self.name = name
+        self.windows = windows
+        self.packets = packets
+
+
+def extractor_windows(make_extractor, output_format='csv', **options):
+    def windows(pcap_file, output_stem):
+        extractor = make_extractor()
+        extractor.pcap_evaluation(pcap_file, output_stem, output_format, **options)
+        return read_table(output_stem + {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}[output_format],
+                          output_format)[Feature_extraction.columns[1:]]
+    return windows
+
+
+def extractor_packets(make_extractor):
+    def packets(pcap_file):
+        extractor = make_extractor()
+        extractor.reset()
+        records, rows = [], []
+        for record, (ts, buf, eth) in enumerate(Pcap_ingestion(pcap_file)):
+            row = extractor.process_packet(ts, buf, eth)
+            if row is not None:
+                records.append(record)
+                rows.append(row[:len(Feature_extraction.columns)])
+        table = pd.DataFrame(rows, columns=Feature_extraction.columns)
+        table.insert(0, 'record', records)
+        return table
+    return packets
+
+
+def batch_packets(pcap_file):
+    extractor = Feature_extraction()
+    extractor.reset()
+    batch = Batch_decoder.packet_rows(extractor, pcap_file)
+    if batch is None:  # the file needs the dpkt engine
+        return REFERENCE.packets(pcap_file)
+    records, rows = batch
+    table = rows.to_frame()
+    table.insert(0, 'record', records)
+    return table
+
+
+def stream_windows(pcap_file, output_stem):
+    windows = []
+    with open(pcap_file, 'rb') as stream:
+        Feature_extraction().stream_evaluation(stream, windows.append)
+    if not windows:
+        return pd.DataFrame(columns=Feature_extraction.columns[1:])
+    return pd.concat(windows, ignore_index=True)
+
+
+def instrumented_windows(pcap_file, output_stem):
+    Feature_extraction().pcap_evaluation(pcap_file, output_stem, report=Extraction_report())
+    return read_table(output_stem + '.csv')
+
+
+def all_stages():
+    # every optional column on: the flow tables and endpoint counters run, the default columns must not change
+    return Feature_extraction(extra_columns=list(Feature_extraction.optional_column_dtypes))
+
+
+# the reference engine and the alternative engines and modes, new engines are added here
+REFERENCE = Engine("reference", extractor_windows(Feature_extraction), extractor_packets(Feature_extraction))
+ENGINES = {
+    "stream": Engine("stream", stream_windows),
+    "parquet": Engine("parquet", extractor_windows(Feature_extraction, 'parquet')),
+    "arrow": Engine("arrow", extractor_windows(Feature_extraction, 'arrow')),
+    "instrumented": Engine("instrumented", instrumented_windows),
+    "batch": Engine("batch", extractor_windows(Feature_extraction, engine='batch'), batch_packets),
+    "all_stages": Engine("all_stages", extractor_windows(all_stages), extractor_packets(all_stages)),
+}
+
+
+def first_difference(reference, other, rtol=1e-9, atol=1e-12):
+    """
+    compares two tables column by column, floats within the tolerances (NaN equals NaN, inf equals inf)
+    :return: None if they are equivalent, otherwise (row, column, reference value, other value) of the
+             first diverging row (a missing column or row has the value None)
+    """
+    for column in reference.columns:
+        if column not in other.columns:
+            return 0, column, reference[column].iloc[0] if len(reference) else None, None
+    for column in other.columns:
+        if column not in reference.columns:
+            return 0, column, None, other[column].iloc[0] if len(other) else None
+    n = min(len(reference), len(other))
+    first = None
+    for column in reference.columns:
+        a = reference[column].to_numpy(dtype=np.float64)[:n]
+        b = other[column].to_numpy(dtype=np.float64)[:n]
+        with np.errstate(invalid='ignore'):
+            close = np.isclose(a, b, rtol=rtol, atol=atol, equal_nan=True) | (a == b)
+        bad = np.flatnonzero(~close)
+        if len(bad) and (first is None or bad[0] < first[0]):
+            first = (int(bad[0]), column, a[bad[0]], b[bad[0]])
+    if first is None and len(reference) != len(other):
+        return n, None, len(reference), len(other)  # the row counts differ
+    return first
+
+
+def compare(pcap_file, engine, reference=REFERENCE, rtol=1e-9, atol=1e-12, n_rows=10):
+    """
+    runs the reference and engine on pcap_file and compares the windows (and the per-packet rows if both
+    engines produce them)
+    :return: dict, 'equal' tells if the engine is equivalent, otherwise the first diverging window, its
+             column and values, and the record number and timestamp of the first packet of the window
+             (or of the first diverging packet)
+    """
+    result = {"pcap_file": pcap_file, "engine": engine.name, "equal": True}
+    with tempfile.TemporaryDirectory() as tmp:
+        expected = reference.windows(pcap_file, os.path.join(tmp, "reference"))
+        actual = engine.windows(pcap_file, os.path.join(tmp, engine.name))
+    result["windows"] = len(expected)
+    packets = reference.packets(pcap_file) if reference.packets else None
+
+    if engine.packets is not None and packets is not None:
+        difference = first_difference(packets, engine.packets(pcap_file), rtol, atol)
+        if difference is not None:
+            row, column, value, other = difference
+            result.update({"equal": False, "window": row // n_rows, "column": column,
+                           "reference": value, "value": other})
+            if row < len(packets):
+                result.update({"packet": int(packets["record"].iloc[row]), "ts": float(packets["ts"].iloc[row])})
+            return result
+
+    difference = first_difference(expected, actual, rtol, atol)
+    if difference is not None:
+        window, column, value, other = difference
+        result.update({"equal": False, "window": window, "column": column, "reference": value, "value": other})
+        if packets is not None and window * n_rows < len(packets):
+            first = packets.iloc[window * n_rows]
+            result.update({"packet": int(first["record"]), "ts": float(first["ts"])})
+    return result
+
+
+def write_tricky_pcap(pcap_file, seed=0):
+    """
+    a small Ethernet pcap with the cases that shape the output: IPv6 frames, ARP, records that are not
+    Ethernet frames (too short to decode, or of an unknown ethernet type), a burst of packets with the
+    same timestamp (zero duration windows) and a last window of a single packet
+    """
+    packets = list(synthetic_packets(200, n_flows=20, seed=seed))
+    ip6 = dpkt.ip6.IP6(src=b'\x20\x01' + b'\x00' * 14, dst=b'\x20\x01' + b'\x00' * 13 + b'\x01', nxt=17, hlim=64,
+                       data=dpkt.udp.UDP(sport=5683, dport=5683, data=b'\x40' * 8))
+    ip6.plen = len(ip6.data)
+    ipv6_frame = bytes(dpkt.ethernet.Ethernet(type=dpkt.ethernet.ETH_TYPE_IP6, data=ip6))
+    arp_frame = bytes(dpkt.ethernet.Ethernet(dst=b'\xff' * 6, type=dpkt.ethernet.ETH_TYPE_ARP,
+                                             data=dpkt.arp.ARP(spa=b'\x0a\x00\x00\x01', tpa=b'\x0a\x00\x00\x02')))
+    records = []
+    for n, (ts, frame) in enumerate(packets):
+        records.append((ts, frame))
+        if n % 7 == 0:
+            records.append((ts, ipv6_frame))
+        if n % 11 == 0:
+            records.append((ts, arp_frame))
+        if n % 13 == 0:
+            records.append((ts, b'\x00\x01\x02'))  # not an Ethernet frame
+            records.append((ts, b'\x02' * 12 + b'\x88\xcc' + b'\x00' * 30))  # LLDP, neither IP nor ARP
+    burst_ts = records[-1][0] + 1.0
+    records.extend((burst_ts, frame) for ts, frame in packets[:25])  # zero duration windows
+    kept = len(packets) + len(range(0, len(packets), 11)) + 25  # the IPv4 and ARP frames make the rows
+    records.extend((burst_ts + 1.0, frame) for ts, frame in packets[:(1 - kept) % 10 or 10])  # a last window of one packet
+    with open(pcap_file, 'wb') as f:
+        writer = dpkt.pcap.Writer(f, linktype=dpkt.pcap.DLT_EN10MB)
+        for ts, frame in records:
+            writer.writepkt(frame, ts=ts)
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import sys
+    parser = argparse.ArgumentParser(
+        description="Runs the reference extraction and alternative engines on the same pcaps and compares the "
+                    "outputs column by column."
+    )
+    parser.add_argument("pcap", nargs="*", help="pcap files to compare on (default: generated tricky and synthetic pcaps)")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument("--rtol", type=float, default=1e-9, help="relative float tolerance (default: 1e-9)")
+    parser.add_argument("--atol", type=float, default=1e-12, help="absolute float tolerance (default: 1e-12)")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        pcap_files = args.pcap
+        if not pcap_files:
+            pcap_files = [os.path.join(tmp, "tricky.pcap"), os.path.join(tmp, "synthetic.pcap")]
+            write_tricky_pcap(pcap_files[0])
+            with open(pcap_files[1], 'wb') as f:
+                writer = dpkt.pcap.Writer(f)
+                for ts, frame in synthetic_packets(5000, n_flows=200):
+                    writer.writepkt(frame, ts=ts)
+        for pcap_file in pcap_files:
+            for name in args.engines:
+                result = compare(pcap_file, ENGINES[name], rtol=args.rtol, atol=args.atol)
+                results.append(result)
+                status = "ok" if result["equal"] else "DIFFERENT"
+                print(f"{status:9} {name:12} {os.path.basename(pcap_file)} ({result['windows']} windows)")
+                if not result["equal"]:
+                    print(json.dumps(result, indent=2, default=str))
+    sys.exit(0 if all(result["equal"] for result in results) else 1)
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import dpkt
+import numpy as np
+
+from Output_writer import output_path
+from Pcap_index import Pcap_index, FILE_HEADER_LEN
+from Pcap_ingestion import file_format
+
+# the modules whose code shapes the extracted tables, their sources are part of the extractor version
+EXTRACTION_MODULES = ["Feature_extraction", "Batch_decoder", "Communication_features", "Connectivity_features",
+                      "Dynamic_features", "Endpoint_counters", "Flow_state", "Layered_features", "Output_writer",
+                      "Pcap_index", "Pcap_ingestion", "Row_buffer", "Supporting_functions", "Window_summary"]
+MODULE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def extractor_version():
+    """
+    sha256 of the sources of the extraction modules and the dpkt version, any change of the code gives new keys
+    """
+    digest = hashlib.sha256(dpkt.__version__.encode())
+    for module in EXTRACTION_MODULES:
+        with open(os.path.join(MODULE_DIRECTORY, module + '.py'), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def update_with_file(digest, f, start=0, end=None):
+    f.seek(start)
+    remaining = None if end is None else end - start
+    while remaining is None or remaining > 0:
+        chunk = f.read(1 << 20 if remaining is None else min(1 << 20, remaining))
+        if not chunk:
+            break
+        digest.update(chunk)
+        if remaining is not None:
+            remaining = remaining - len(chunk)
+
+
+def content_hash(pcap_file, byte_range=None, time_range=None, record_offsets=None):
+    """
+    sha256 of the bytes an extraction reads: the file header and the byte range (the range of time_range)
+    of an uncompressed pcap file, otherwise the whole file and the record offsets
+    """
+    digest = hashlib.sha256()
+    with open(pcap_file, 'rb') as f:
+        if file_format(pcap_file) == 'pcap' and record_offsets is None and \
+                (byte_range is not None or time_range is not None):
+            if byte_range is None:
+                byte_range = Pcap_index.load(pcap_file).time_range(*time_range)
+            update_with_file(digest, f, 0, FILE_HEADER_LEN)
+            update_with_file(digest, f, max(byte_range[0], FILE_HEADER_LEN), max(byte_range[1], FILE_HEADER_LEN))
+        else:
+            update_with_file(digest, f)
+    if record_offsets is not None:
+        digest.update(np.asarray(record_offsets, dtype=np.uint64).tobytes())
+    return digest.hexdigest()
+
+
+class Extraction_cache:
+    """
+    Local cache of extracted tables, content addressed: the key is the hash of the bytes of the pcap file
+    (or shard) that are read, the extraction settings and the extractor version. An entry is a directory
+    with the output files and their row counts; it is written to a temp directory and renamed into place,
+    so that parallel workers never see half an entry. The least recently used entries are evicted when
+    the cache grows beyond max_bytes.
+    """
+    def __init__(self, directory, max_bytes=20 * 10 ** 9):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = None
+
+    def key(self, pcap_file, settings, byte_range=None, time_range=None, record_offsets=None):
+        """
+        settings: dict of everything else that changes the tables (columns, windows, output format, ...)
+        """
+        if self.version is None:
+            self.version = extractor_version()
+        digest = hashlib.sha256(self.version.encode())
+        digest.update(content_hash(pcap_file, byte_range, time_range, record_offsets).encode())
+        digest.update(json.dumps(settings, sort_keys=True, default=list).encode())
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key, file_stem, output_format='csv'):
+        """
+        copies the tables of a cached extraction to file_stem + suffix
+        :return: {suffix: rows} of the tables, None if the key is not cached
+        """
+        path = self.entry_path(key)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                rows_written = json.load(f)["rows_written"]
+            for suffix in rows_written:
+                shutil.copyfile(output_path(os.path.join(path, 'table' + suffix), output_format),
+                                output_path(file_stem + suffix, output_format))
+            os.utime(path)  # last use, for the LRU eviction
+        except OSError:  # not cached, or evicted meanwhile
+            return None
+        return rows_written
+
+    def put(self, key, file_stem, output_format, rows_written):
+        """
+        stores the tables file_stem + suffix of every suffix of rows_written, then evicts the least recently
+        used entries beyond max_bytes (a table set larger than max_bytes is not stored)
+        """
+        files = {suffix: output_path(file_stem + suffix, output_format) for suffix in rows_written}
+        if sum(os.path.getsize(path) for path in files.values()) > self.max_bytes:
+            return
+        os.makedirs(os.path.join(self.directory, key[:2]), exist_ok=True)
+        tmp_path = tempfile.mkdtemp(prefix=".cache_tmp_", dir=self.directory)
+        try:
+            for suffix, path in files.items():
+                shutil.copyfile(path, output_path(os.path.join(tmp_path, 'table' + suffix), output_format))
+            with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+                json.dump({"rows_written": rows_written, "output_format": output_format, "created": time.time()}, f)
+            os.rename(tmp_path, self.entry_path(key))
+        except OSError:  # already stored by another worker
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """
+        :return: (last use, size in bytes, path) of every entry
+        """
+        entries = []
+        for prefix in os.scandir(self.directory):
+            if not prefix.is_dir() or prefix.name.startswith('.'):
+                continue
+            for entry in os.scandir(prefix.path):
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                except OSError:  # evicted meanwhile
+                    continue
+        return entries
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            # renamed first, so that a reader never copies from a half deleted entry
+            trash = tempfile.mkdtemp(prefix=".cache_evicted_", dir=self.directory)
+            try:
+                os.rename(path, os.path.join(trash, 'entry'))
+            except OSError:
+                pass
+            shutil.rmtree(trash, ignore_errors=True)
+            total = total - size
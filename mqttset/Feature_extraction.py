@@ -1,15 +1,21 @@
 import dpkt
 import pandas as pd
 import json
-from scapy.all import *
+import os
+import Batch_decoder
 from Communication_features import Communication_wifi, Communication_zigbee
 from Connectivity_features import Connectivity_features_basic, Connectivity_features_time, \
     Connectivity_features_flags_bytes
-from Dynamic_features import Dynamic_features
-from Layered_features import L3, L4, L2, L1
+from Dynamic_features import Two_stream_stats
+from Endpoint_counters import Proto_endpoint_counter
+from Flow_state import Flow_table, flow_key, is_forward
+from Layered_features import ETHERNET_TYPES, classify, indicator_values
+from Output_writer import write_table
+from Pcap_ingestion import Pcap_ingestion
+from Row_buffer import Row_buffer
 from Supporting_functions import get_protocol_name, get_flow_info, get_flag_values, compare_flow_flags, \
-    get_src_dst_packets, calculate_incoming_connections, \
-    calculate_packets_counts_per_ips_proto, calculate_packets_count_per_ports_proto
+    get_src_dst_packets, calculate_incoming_connections
+from Window_summary import summarize_windows, summarize_time_windows
     
 from tqdm import tqdm
 import time
@@ -22,501 +28,647 @@ class Feature_extraction():
                    "ack_count", "syn_count", "fin_count","rst_count",           
                    "HTTP", "HTTPS", "DNS", "Telnet","SMTP", "SSH", "IRC", "TCP", "UDP", "DHCP","ARP", "ICMP", "IGMP", "IPv", "LLC",
         "Tot sum", "Min", "Max", "AVG", "Std","Tot size", "IAT", "Number", "Variance"]
+    # dtype of every per-packet column in the row buffer
+    column_dtypes = {"ts": "float64", "Header_Length": "uint16", "Protocol Type": "uint8", "Time_To_Live": "uint8",
+                     "Rate": "float64"}
+    column_dtypes.update({c: "uint8" for c in columns[5:12]})     # flags
+    column_dtypes.update({c: "uint32" for c in columns[12:16]})   # flag counts
+    column_dtypes.update({c: "uint8" for c in columns[16:31]})    # protocol indicators
+    column_dtypes.update({"Tot sum": "uint32", "Min": "uint32", "Max": "uint32", "AVG": "float64", "Std": "float64",
+                          "Tot size": "uint32", "IAT": "float64", "Number": "uint32", "Variance": "float64"})
+    # opt-in columns, appended after the columns above in this order
+    optional_column_dtypes = {"AR_P_Proto_P_SrcIP": "float64", "AR_P_Proto_P_Dst_IP": "float64",
+                              "ar_p_proto_p_src_sport": "float64", "ar_p_proto_p_dst_dport": "float64",
+                              "flow_duration": "float64", "Srate": "float64", "Drate": "float64", "urg_count": "uint32",
+                              "Magnitue": "float64", "Radius": "float64", "Correlation": "float64",
+                              "Covariance": "float64", "Var_ratio": "float64", "Weight": "uint32"}
+    # optional processing stages and the columns that need them, a stage runs only if one of its columns is written
+    stage_columns = {"flags": columns[5:16] + ["urg_count"],
+                     "indicators": columns[16:31],
+                     "flows": ["flow_duration", "Srate", "Drate"],
+                     "endpoint_counts": ["AR_P_Proto_P_SrcIP", "AR_P_Proto_P_Dst_IP", "ar_p_proto_p_src_sport",
+                                         "ar_p_proto_p_dst_dport"],
+                     "two_streams": ["Magnitue", "Radius", "Correlation", "Covariance", "Var_ratio", "Weight"]}
     
     
-    def pcap_evaluation(self,pcap_file,csv_file_name):
-        global ethsize, src_ports, dst_ports, src_ips, dst_ips, ips , tcpflows, udpflows, src_packet_count, dst_packet_count, src_ip_byte, dst_ip_byte
-        global protcols_count, tcp_flow_flgs, incoming_packets_src, incoming_packets_dst, packets_per_protocol, average_per_proto_src
-        global average_per_proto_dst, average_per_proto_src_port, average_per_proto_dst_port
-        columns = ["ts","Header_Length","Protocol Type","Time_To_Live","Rate", "fin_flag_number","syn_flag_number","rst_flag_number"
-                   ,"psh_flag_number","ack_flag_number","ece_flag_number","cwr_flag_number",
-                   "ack_count", "syn_count", "fin_count","rst_count",           
-                   "HTTP", "HTTPS", "DNS", "Telnet","SMTP", "SSH", "IRC", "TCP", "UDP", "DHCP","ARP", "ICMP", "IGMP", "IPv", "LLC",
-        "Tot sum", "Min", "Max", "AVG", "Std","Tot size", "IAT", "Number", "Variance"]
-        base_row = {c:[] for c in columns}
-        #print(base_row)
-        start = time.time()
-        ethsize = []
-        src_ports = {}  # saving the number of source port used
-        dst_ports = {}  # saving the number of destination port used
-        tcpflows = {}  # saving the whole tcpflows
-        udpflows = {}  # saving the whole udpflows 
-        src_packet_count = {}  # saving the number of packets per source IP
-        dst_packet_count = {}  # saving the number of packets per destination IP
-        dst_port_packet_count = {}  # saving the number of packets per destination port
-        src_ip_byte, dst_ip_byte = {}, {}
-        tcp_flow_flags = {}  # saving the number of flags for each flow
-        packets_per_protocol = {}   # saving the number of packets per protocol
-        average_per_proto_src = {}  # saving the number of packets per protocol and src_ip
-        average_per_proto_dst = {}  # saving the number of packets per protocol and dst_ip
-        average_per_proto_src_port, average_per_proto_dst_port = {}, {}    # saving the number of packets per protocol and src_port and dst_port
-        ips = set()  # saving unique IPs
-        number_of_packets_per_trabsaction = 0  # saving the number of packets per transaction
-        rate, srate, drate = 0, 0, 0
-        max_duration, min_duration, sum_duration, average_duration, std_duration = 0, 0, 0, 0, 0   # duration-related features of aggerated records
-        total_du = 0 # total duration
-        first_pac_time = 0
-        last_pac_time = 0
-        incoming_pack = []
-        outgoing_pack = []
-        f = open(pcap_file, 'rb')
-        pcap = dpkt.pcap.Reader(f)
-        ## Using SCAPY for Zigbee and blutooth ##
-        scapy_pak = rdpcap(pcap_file)
-        count = 0  # counting the packets
-        count_rows = 0
-        for ts, buf in (pcap):
-            if type(scapy_pak[count]) == scapy.layers.bluetooth:
-                pass
-            elif type(scapy_pak[count]) == scapy.layers.zigbee.ZigbeeNWKCommandPayload:
-                zigbee = Communication_zigbee(scapy_pak[count])
-            try:
-               eth = dpkt.ethernet.Ethernet(buf)
-               count = count + 1
-            except:
-                count = count + 1
-                continue  # If packet format is not readable by dpkt, discard the packet
-
-            #my_src = socket.inet_ntoa(eth.data.src)
+    def __init__(self, idle_timeout=120, active_timeout=3600, max_flows=100000, on_flow_end=None,
+                 extra_columns=(), features=None, block_size=20):
+        """
+        features is the list of the columns to write (default: every column but ts, followed by extra_columns),
+        the parsing and bookkeeping that none of them needs is skipped.
+        extra_columns selects opt-in columns of optional_column_dtypes, e.g. the average rates per protocol
+        and endpoint (AR_P_Proto_P_SrcIP: packets of the protocol from the source ip per second of capture).
+        idle_timeout, active_timeout (seconds) and max_flows bound the flow tables, on_flow_end(flow, state)
+        receives the final statistics (Flow_state) of every flow once, when it is evicted (the flow is a packed
+        key, see Flow_state.flow_key_endpoints).
+        block_size is the number of IP/ARP packets after which the two-stream statistics start over
+        """
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.max_flows = max_flows
+        self.on_flow_end = on_flow_end
+        self.block_size = block_size
+        self.rows_written = {}  # output file suffix (see window_suffixes) -> rows written by the last pcap_evaluation
+        unknown = [c for c in extra_columns if c not in self.optional_column_dtypes]
+        if unknown:
+            raise ValueError(f"unknown columns {unknown}, expected some of {list(self.optional_column_dtypes)}")
+        if features is None:
+            features = Feature_extraction.columns[1:]
+        features = list(features) + [c for c in extra_columns if c not in features]
+        known = Feature_extraction.columns[1:] + list(self.optional_column_dtypes)
+        unknown = [c for c in features if c not in known]
+        if unknown:
+            raise ValueError(f"unknown columns {unknown}, expected some of {known}")
+        self.features = features
+        self.extra_columns = [c for c in self.optional_column_dtypes if c in features]
+        self.columns = Feature_extraction.columns + self.extra_columns
+        self.column_dtypes = dict(Feature_extraction.column_dtypes)
+        self.column_dtypes.update({c: self.optional_column_dtypes[c] for c in self.extra_columns})
+        self.stages = {stage for stage, columns in self.stage_columns.items() if any(c in features for c in columns)}
+        if on_flow_end is not None:
+            self.stages.add("flows")
+
+    def new_flow_table(self):
+        return Flow_table(self.idle_timeout, self.active_timeout, self.max_flows, self.on_flow_end)
+
+    def reset(self):
+        """
+        initializes the state that is carried from packet to packet
+        """
+        self.ethsize = []
+        self.src_ports = {}  # saving the number of source port used
+        self.dst_ports = {}  # saving the number of destination port used
+        self.tcpflows = self.new_flow_table()  # saving the running statistics (Flow_state) of each open tcp flow
+        self.udpflows = self.new_flow_table()  # saving the running statistics (Flow_state) of each open udp flow
+        self.src_packet_count = {}  # saving the number of packets per source IP
+        self.dst_packet_count = {}  # saving the number of packets per destination IP
+        self.dst_port_packet_count = {}  # saving the number of packets per destination port
+        self.src_ip_byte, self.dst_ip_byte = {}, {}
+        self.tcp_flow_flags = {}  # saving the number of flags for each flow
+        self.packets_per_protocol = {}   # saving the number of packets per protocol
+        self.average_per_proto_src = Proto_endpoint_counter()  # saving the number of packets per protocol and src_ip
+        self.average_per_proto_dst = Proto_endpoint_counter()  # saving the number of packets per protocol and dst_ip
+        self.average_per_proto_src_port = Proto_endpoint_counter()  # saving the number of packets per protocol and src_port
+        self.average_per_proto_dst_port = Proto_endpoint_counter()  # saving the number of packets per protocol and dst_port
+        self.ips = set()  # saving unique IPs
+        self.start_ts = None  # timestamp of the first packet
+        self.total_du = 0 # total duration, elapsed since the first packet
+        self.first_pac_time = 0
+        self.last_pac_time = 0
+        self.two_streams = Two_stream_stats()  # incoming/outgoing packet lengths of the current block of packets
+        self.block_source = None  # source address of the first packet of the block, its packets are the outgoing ones
+        self.count = 0  # counting the packets
+
+    def trim_state(self, max_entries):
+        """
+        bounds the memory of a long running extraction: a per-endpoint table that grew beyond
+        max_entries entries is started over (the flow tables bound themselves)
+        """
+        for name in ("src_ports", "dst_ports", "src_packet_count", "dst_packet_count",
+                     "dst_port_packet_count", "src_ip_byte", "dst_ip_byte", "tcp_flow_flags", "packets_per_protocol",
+                     "average_per_proto_src", "average_per_proto_dst", "average_per_proto_src_port",
+                     "average_per_proto_dst_port", "ips"):
+            table = getattr(self, name)
+            if len(table) > max_entries:
+                table.clear()
+
+    def process_packet(self, ts, buf, eth):
+        """
+        computes the per-packet row of a decoded record (a tuple in the order of columns),
+        returns None if the packet is discarded
+        """
+        self.count = self.count + 1
+        if not isinstance(eth, dpkt.ethernet.Ethernet):
+            ## Zigbee and bluetooth records are decoded by SCAPY ##
+            if eth is not None and eth.haslayer('ZigbeeNWKCommandPayload'):
+                zigbee = Communication_zigbee(eth.getlayer('ZigbeeNWKCommandPayload'))
+            return None  # If packet format is not readable by dpkt, discard the packet
+        if eth.type == dpkt.ethernet.ETH_TYPE_IP and not isinstance(eth.data, dpkt.ip.IP):
+            return None  # IP header not readable by dpkt (truncated, cut by the snaplen), discard the packet
+
+        #my_src = socket.inet_ntoa(eth.data.src)
 			# read the destination IP in dst
-            #my_dst = socket.inet_ntoa(eth.data.dst)
+        #my_dst = socket.inet_ntoa(eth.data.dst)
 
-            #print ('Timestamp: ', str(datetime.datetime.utcfromtimestamp(ts)))
+        #print ('Timestamp: ', str(datetime.datetime.utcfromtimestamp(ts)))
 
-            
+        
 
 			# Print the source and destination IP
-            #print('Source: ' +my_src+ ' Destination: '  +my_dst)
-            ethernet_frame_size = len(buf)
-            
-            #print('buf size : ', len(buf))
-            
-            #print('ethernet_frame_size : ', ethernet_frame_size)
-            #print('size : ', len(eth.data))
-            ethernet_frame_type = eth.type
-            total_du = total_du + ts
-            # initilization #
-            src_port, src_ip, dst_port, time_to_live, header_len = 0, 0, 0, 0, 0
-            dst_ip, proto_type, protocol_name = 0, 0, ""
-            flow_duration, flow_byte = 0, 0
-            src_byte_count, dst_byte_count = 0, 0
-            src_pkts, dst_pkts = 0, 0
-            connection_status = 0
-            number = 0
-            IAT = 0
-            src_to_dst_pkt, dst_to_src_pkt = 0, 0  # count of packets from src to des and vice-versa
-            src_to_dst_byte, dst_to_src_byte = 0, 0  # Total bytes of packets from src to dst and vice-versa
-            # flags
-            flag_valus = []  # numerical values of packet(TCP) flags
-            ack_count, syn_count, fin_count, urg_count, rst_count = 0, 0, 0, 0, 0
-            # Layered flags
-            udp, tcp, http, https, arp, smtp, irc, ssh, dns, ipv, icmp, igmp, mqtt, coap = 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0
-            telnet, dhcp, llc, mac, rarp = 0, 0, 0, 0, 0
-            sum_packets, min_packets, max_packets, mean_packets, std_packets = 0, 0, 0, 0, 0
-            magnite, radius, correlation, covaraince, var_ratio, weight = 0, 0, 0, 0, 0, 0
-            idle_time, active_time = 0, 0
-            type_info, sub_type_info, ds_status, src_mac, dst_mac, sequence, pack_id, fragments, wifi_dur = 0, 0, 0, 0, 0, 0, 0, 0, 0
-            if eth.type == dpkt.ethernet.ETH_TYPE_IP or eth.type == dpkt.ethernet.ETH_TYPE_ARP:
-                ethsize.append(ethernet_frame_size)
+        #print('Source: ' +my_src+ ' Destination: '  +my_dst)
+        ethernet_frame_size = len(buf)
+        
+        #print('buf size : ', len(buf))
+        
+        #print('ethernet_frame_size : ', ethernet_frame_size)
+        #print('size : ', len(eth.data))
+        ethernet_frame_type = eth.type
+        if self.start_ts is None:
+            self.start_ts = ts
+        self.total_du = ts - self.start_ts
+        # initilization #
+        src_port, src_ip, dst_port, time_to_live, header_len = 0, 0, 0, 0, 0
+        dst_ip, proto_type, protocol_name = 0, 0, ""
+        flow_duration, flow_byte = 0, 0
+        srate, drate = 0, 0
+        src_byte_count, dst_byte_count = 0, 0
+        src_pkts, dst_pkts = 0, 0
+        proto_src_pkts, proto_dst_pkts, proto_src_port_pkts, proto_dst_port_pkts = 0, 0, 0, 0
+        number = 0
+        IAT = 0
+        src_to_dst_pkt, dst_to_src_pkt = 0, 0  # count of packets from src to des and vice-versa
+        src_to_dst_byte, dst_to_src_byte = 0, 0  # Total bytes of packets from src to dst and vice-versa
+        # flags
+        flag_valus = []  # numerical values of packet(TCP) flags
+        ack_count, syn_count, fin_count, urg_count, rst_count = 0, 0, 0, 0, 0
+        # Layered flags
+        indicators = 0  # HTTP, TCP, ARP, ... as a bit mask (see Layered_features.INDICATORS)
+        rarp = 0
+        sum_packets, min_packets, max_packets, mean_packets, std_packets = 0, 0, 0, 0, 0
+        magnite, radius, correlation, covaraince, var_ratio, weight = 0, 0, 0, 0, 0, 0
+        idle_time, active_time = 0, 0
+        type_info, sub_type_info, ds_status, src_mac, dst_mac, sequence, pack_id, fragments, wifi_dur = 0, 0, 0, 0, 0, 0, 0, 0, 0
+        if eth.type == dpkt.ethernet.ETH_TYPE_IP or eth.type == dpkt.ethernet.ETH_TYPE_ARP:
+            self.ethsize.append(ethernet_frame_size)
+            indicators = ETHERNET_TYPES[eth.type]
+            srcs = {}
+            dsts = {}
+
+            if self.last_pac_time == 0: 
+                self.last_pac_time = ts
+            IAT = ts - self.last_pac_time
+            self.last_pac_time = ts
+            if len(self.ethsize) % self.block_size == 0:
+                #sum_packets, min_packets, max_packets, mean_packets, std_packets = dy.dynamic_calculation(ethsize)
+                #print('sum packets : ', sum_packets)
+                if "two_streams" in self.stages:
+                    magnite, radius, correlation, covaraince, var_ratio, weight = self.two_streams.values()
+                self.ethsize = []
                 srcs = {}
                 dsts = {}
-
-                if last_pac_time == 0: 
-                    last_pac_time = ts
-                IAT = ts - last_pac_time
-                last_pac_time = ts
-                if len(ethsize) % 20 == 0:  
-                    dy = Dynamic_features()    
-                    #sum_packets, min_packets, max_packets, mean_packets, std_packets = dy.dynamic_calculation(ethsize)
-                    #print('sum packets : ', sum_packets)
-                    #magnite, radius, correlation, covaraince, var_ratio, weight = dy.dynamic_two_streams(incoming_pack,
-                                                                                                      #   outgoing_pack) 
-                    ethsize = []
-                    srcs = {}
-                    dsts = {}
-                    incoming_pack = []
-                    outgoing_pack = []
-                    first_pac_time = 0 
-                    #last_pac_time = ts
-                    #IAT = last_pac_time - first_pac_time
-                    #first_pac_time = last_pac_time
-                else:
-                    dy = Dynamic_features()
-                    #sum_packets, min_packets, max_packets, mean_packets, std_packets = dy.dynamic_calculation(ethsize)
-                    #print('sum packets : ', sum_packets)
-                    #last_pac_time = ts
-                    #IAT = last_pac_time - first_pac_time
-                    #first_pac_time = last_pac_time
-                    #con_basic = Connectivity_features_basic(eth.data)
-                    #dst = con_basic.get_destination_ip()
-                    #src = con_basic.get_destination_ip()
-                    #src= con_basic.get_source_ip()  
-                    #print('The destination is : ', dst)
-                    #print('The source 1 is : ', src)
-                    #print('The source 2 is : ', src2)
-
+                self.two_streams.clear()
+                self.block_source = None
+                self.first_pac_time = 0 
+                #last_pac_time = ts
+                #IAT = last_pac_time - first_pac_time
+                #first_pac_time = last_pac_time
+            else:
+                #dy = Dynamic_features()
+                #sum_packets, min_packets, max_packets, mean_packets, std_packets = dy.dynamic_calculation(ethsize)
+                #print('sum packets : ', sum_packets)
+                #last_pac_time = ts
+                #IAT = last_pac_time - first_pac_time
+                #first_pac_time = last_pac_time
+                #con_basic = Connectivity_features_basic(eth.data)
+                #dst = con_basic.get_destination_ip()
+                #src = con_basic.get_destination_ip()
+                #src= con_basic.get_source_ip()  
+                #print('The destination is : ', dst)
+                #print('The source 1 is : ', src)
+                #print('The source 2 is : ', src2)
+
+           
                
-                   
-                    '''if src in dsts:
-                        outgoing_pack.append(ethernet_frame_size)
-                    else:
-                        dsts[src] = 1
-                        outgoing_pack.append(ethernet_frame_size)
-
-                    if dst in srcs:
-                        incoming_pack.append(ethernet_frame_size)
-                    else:
-                        srcs[dst] = 1
-                        incoming_pack.append(ethernet_frame_size)'''
-                    #magnite, radius, correlation, covaraince, var_ratio, weight = dy.dynamic_two_streams(incoming_pack,
-                                                                                                         #outgoing_pack)
-                    # print("not 20 yet")
-                if eth.type == dpkt.ethernet.ETH_TYPE_IP:     # IP packets
-                    # print("IP packet")
+                if "two_streams" in self.stages:
+                    # the packets sent by the first source (IP or ARP sender address) of the block are outgoing,
+                    # the others incoming
+                    source = getattr(eth.data, 'src' if eth.type == dpkt.ethernet.ETH_TYPE_IP else 'spa', None)
+                    if self.block_source is None:
+                        self.block_source = source
+                    self.two_streams.add(ethernet_frame_size, source == self.block_source)
+                    magnite, radius, correlation, covaraince, var_ratio, weight = self.two_streams.values()
+                # print("not 20 yet")
+            if eth.type == dpkt.ethernet.ETH_TYPE_IP:     # IP packets
+                # print("IP packet")
+            
                 
-                    
-                    ipv = 1
-                    ip = eth.data
+                ip = eth.data
 
-                    if ip == dpkt.ip6.IP6:  # discard IPv6 packets
-                        continue
+                if ip == dpkt.ip6.IP6:  # discard IPv6 packets
+                    return None
 
 
-                    con_basic = Connectivity_features_basic(ip)
+                con_basic = Connectivity_features_basic(ip)
 
-                    #Dynamic_packets
-                    dy = Dynamic_features()
-                    # number = dy.dynamic_count(protcols_count) 
+                #Dynamic_packets
+                # number = dy.dynamic_count(protcols_count) 
 
 
-                    # Connectivity_basic_features
-                    src_ip = con_basic.get_source_ip()
+                # Connectivity_basic_features
+                src_ip = con_basic.get_source_address()  # raw addresses, converted to strings only for the output
 
-                    proto_type = con_basic.get_protocol_type()
-                    #print("The protocol type is : " , proto_type)
-                    dst_ip = con_basic.get_destination_ip()
+                proto_type = con_basic.get_protocol_type()
+                #print("The protocol type is : " , proto_type)
+                dst_ip = con_basic.get_destination_address()
 
-                    ips.add(dst_ip)
-                    ips.add(src_ip)
+                stages = self.stages
+                if "endpoint_counts" in stages:
+                    self.ips.add(dst_ip)
+                    self.ips.add(src_ip)
 
-                    # Connectivity_time_features
-                    con_time = Connectivity_features_time(ip)
-                    time_to_live= con_time.time_to_live() # time_to_live of packet
-                    potential_packet = ip.data
+                # Connectivity_time_features
+                con_time = Connectivity_features_time(ip)
+                time_to_live= con_time.time_to_live() # time_to_live of packet
+                potential_packet = ip.data
 
-                    # Connectivity_features_flags_bytes
-                    # Counts the src ips and dest ips
+                # Connectivity_features_flags_bytes
+                # Counts the src ips and dest ips
+                if "endpoint_counts" in stages:
                     conn_flags_bytes = Connectivity_features_flags_bytes(ip)
-                    src_byte_count, dst_byte_count = conn_flags_bytes.count(src_ip_byte, dst_ip_byte) 
-
-                    # L_three_layered_features
-                    l_three = L3(potential_packet)
-                    udp = l_three.udp()
-                    tcp = l_three.tcp()
-
-                    protocol_name = get_protocol_name(proto_type)
-                    if protocol_name == "ICMP":
-                        icmp = 1
-                    elif protocol_name == "IGMP":
-                        igmp = 1
-                    # L1_features
-                    l_one = L1(potential_packet)
-                    llc = l_one.LLC()
-                    mac = l_one.MAC()
-
-
-                    # Extra features of Bot-IoT and Ton-IoT
-
-                    # Average rate features
-                    calculate_packets_counts_per_ips_proto(average_per_proto_src, protocol_name, src_ip, average_per_proto_dst,
-                                              dst_ip)
-                    calculate_packets_count_per_ports_proto(average_per_proto_src_port, average_per_proto_dst_port,
-                                                            protocol_name, src_port, dst_port)
-                    #----end of Average rate features ---#
+                    src_byte_count, dst_byte_count = conn_flags_bytes.count(self.src_ip_byte, self.dst_ip_byte) 
 
-                    # if packets_per_protocol.get(protocol_name):
-                    #     packets_per_protocol[protocol_name] = packets_per_protocol[protocol_name] + 1
-                    # else:
-                    #     packets_per_protocol[protocol_name] = 1
+                protocol_name = get_protocol_name(proto_type)
+                # Layered features (ICMP, IGMP), the TCP/UDP ones are added with the ports below
+                if "indicators" in stages:
+                    indicators = indicators | classify(proto_type)
 
-                    # if protocol_name in protcols_count.keys():
-                    #     protcols_count[protocol_name] = protcols_count[protocol_name] + 1
-                    # else:
-                    #     protcols_count[protocol_name] = 1
 
+                # Extra features of Bot-IoT and Ton-IoT
 
-                    
-                    if src_ip not in src_packet_count.keys():
-                        src_packet_count[src_ip] = 1
+                # if packets_per_protocol.get(protocol_name):
+                #     packets_per_protocol[protocol_name] = packets_per_protocol[protocol_name] + 1
+                # else:
+                #     packets_per_protocol[protocol_name] = 1
+
+                # if protocol_name in protcols_count.keys():
+                #     protcols_count[protocol_name] = protcols_count[protocol_name] + 1
+                # else:
+                #     protcols_count[protocol_name] = 1
+
+
+                
+                if "endpoint_counts" in stages:
+                    if src_ip not in self.src_packet_count.keys():
+                        self.src_packet_count[src_ip] = 1
                     else:
-                        src_packet_count[src_ip] = src_packet_count[src_ip] + 1
+                        self.src_packet_count[src_ip] = self.src_packet_count[src_ip] + 1
 
 
-                    if dst_ip not in dst_packet_count.keys():
-                        dst_packet_count[dst_ip] = 1
+                    if dst_ip not in self.dst_packet_count.keys():
+                        self.dst_packet_count[dst_ip] = 1
                     else:
-                        dst_packet_count[dst_ip] = dst_packet_count[dst_ip] + 1
-
-                    src_pkts, dst_pkts = src_packet_count[src_ip], dst_packet_count[dst_ip] # counts of source, and dest ips
-                    l_four_both = L4(src_port, dst_port)
-                    coap = l_four_both.coap()
-                    smtp = l_four_both.smtp()
-                    # Features related to UDP
-                    if type(potential_packet) == dpkt.udp.UDP:
-                        src_port = con_basic.get_source_port()
-                        dst_port = con_basic.get_destination_port()
-                        header_len = 8 #Header length is fixed in UDP 
-                        # L4 features
-                        l_four = L4(src_port, dst_port)
-                        l_two = L2(src_port, dst_port)
-                        dhcp = l_two.dhcp()
-                        dns = l_four.dns()
-                        if dst_port in dst_port_packet_count.keys():
-                            dst_packet_count[dst_port] = dst_port_packet_count[dst_port] + 1
-                        else:
-                            dst_packet_count[dst_port] = 1
-
-                        flow = sorted([(src_ip, src_port), (dst_ip, dst_port)])
-                        flow = (flow[0], flow[1])
-                        flow_data = {
-                            'byte_count': len(eth),
-                            'header_len' : header_len,
-                            'ts': ts
-                        }
-                        if udpflows.get(flow):
-                            udpflows[flow].append(flow_data)
+                        self.dst_packet_count[dst_ip] = self.dst_packet_count[dst_ip] + 1
+
+                    src_pkts, dst_pkts = self.src_packet_count[src_ip], self.dst_packet_count[dst_ip] # counts of source, and dest ips
+                # Features related to UDP
+                if type(potential_packet) == dpkt.udp.UDP:
+                    src_port = con_basic.get_source_port()
+                    dst_port = con_basic.get_destination_port()
+                    header_len = 8 #Header length is fixed in UDP 
+                    # L4 features (UDP, DNS, DHCP, ...)
+                    if "indicators" in stages:
+                        indicators = indicators | classify(proto_type, True, src_port, dst_port)
+                    if "endpoint_counts" in stages:
+                        if dst_port in self.dst_port_packet_count.keys():
+                            self.dst_packet_count[dst_port] = self.dst_port_packet_count[dst_port] + 1
                         else:
-                            udpflows[flow] = [flow_data]
-                        packets = udpflows[flow]
-                        number_of_packets_per_trabsaction = len(packets)
-                        flow_byte, flow_duration, max_duration, min_duration, sum_duration, average_duration, std_duration, idle_time,active_time = get_flow_info(udpflows,flow)
-                        src_to_dst_pkt, dst_to_src_pkt, src_to_dst_byte, dst_to_src_byte = get_src_dst_packets(udpflows, flow)
-                    # Features related to TCP
-                    elif type(potential_packet) == dpkt.tcp.TCP:
-                        src_port = con_basic.get_source_port()
-                        dst_port = con_basic.get_destination_port()
-                        header_len = con_basic.get_header_len()
-                        #print('Header Length TCP : ', header_len)
-                        if dst_port in dst_port_packet_count.keys():
-                            dst_packet_count[dst_port] = dst_port_packet_count[dst_port] + 1
+                            self.dst_packet_count[dst_port] = 1
+
+                    if "flows" in stages:
+                        flow = flow_key(src_ip, src_port, dst_ip, dst_port)
+                        forward = is_forward(flow, src_ip, src_port)
+                        number_of_packets_per_trabsaction = self.udpflows.update(flow, len(eth), header_len, ts, forward).packets
+                        flow_byte, flow_duration, max_duration, min_duration, sum_duration, average_duration, std_duration, idle_time,active_time = get_flow_info(self.udpflows,flow)
+                        src_to_dst_pkt, dst_to_src_pkt, src_to_dst_byte, dst_to_src_byte = get_src_dst_packets(self.udpflows, flow, forward)
+                # Features related to TCP
+                elif type(potential_packet) == dpkt.tcp.TCP:
+                    src_port = con_basic.get_source_port()
+                    dst_port = con_basic.get_destination_port()
+                    header_len = con_basic.get_header_len()
+                    #print('Header Length TCP : ', header_len)
+                    if "endpoint_counts" in stages:
+                        if dst_port in self.dst_port_packet_count.keys():
+                            self.dst_packet_count[dst_port] = self.dst_port_packet_count[dst_port] + 1
                         else:
-                            dst_packet_count[dst_port] = 1
+                            self.dst_packet_count[dst_port] = 1
 
+                    if "flags" in stages:
                         flag_valus = get_flag_values(ip.data)
-                        # L4 features based on TCP
-                        l_four = L4(src_port,dst_port)
-                        http = l_four.http()
-                        https = l_four.https()
-                        ssh = l_four.ssh()
-                        irc = l_four.IRC()
-                        smtp = l_four.smtp()
-                        mqtt = l_four.mqtt()
-                        telnet = l_four.telnet()
-
-                        try:
-                            http_info = dpkt.http.Response(ip.data)
-                            connection_status = http_info.status
-                        except:
-                            # print("No status")
-                            connection_status = 0
-
-
-                        flow = sorted([(src_ip, src_port), (dst_ip, dst_port)])
-                        flow = (flow[0], flow[1])
-                        flow_data = {
-                            'byte_count': len(eth),
-                            'header_len': header_len,
-                            'ts': ts
-                        }
-                        
                         ack_count,syn_count,fin_count,urg_count,rst_count = compare_flow_flags(flag_valus,ack_count,syn_count,fin_count,urg_count,rst_count)
-                     
-                        
-                        if tcpflows.get(flow):
-                            tcpflows[flow].append(flow_data)
-                            # comparing Flow state based on its flags
-                            #ack_count, syn_count, fin_count, urg_count, rst_count = tcp_flow_flags[flow]
-                            #ack_count,syn_count,fin_count,urg_count,rst_count = compare_flow_flags(flag_valus,ack_count,syn_count,fin_count,urg_count,rst_count)
-                         
-                            #tcp_flow_flags[flow] = [ack_count, syn_count, fin_count, urg_count, rst_count]
-                        else:
-                            tcpflows[flow] = [flow_data]
-                            #ack_count,syn_count,fin_count,urg_count,rst_count = compare_flow_flags(flag_valus, ack_count, syn_count, fin_count, urg_count, rst_count)
-        
-                            #tcp_flow_flags[flow] = [ack_count,syn_count,fin_count,urg_count,rst_count]
-
+                    # L4 features based on TCP (TCP, HTTP, HTTPS, SSH, ...)
+                    if "indicators" in stages:
+                        indicators = indicators | classify(proto_type, True, src_port, dst_port)
 
-                        
-                        packets = tcpflows[flow]
+                    if "flows" in stages:
+                        flow = flow_key(src_ip, src_port, dst_ip, dst_port)
+                        forward = is_forward(flow, src_ip, src_port)
                         #Get the number of packets in that specific flow 
-                        number_of_packets_per_trabsaction = len(packets)
-                        flow_byte, flow_duration,max_duration,min_duration,sum_duration,average_duration,std_duration,idle_time,active_time = get_flow_info(tcpflows,flow)
+                        number_of_packets_per_trabsaction = self.tcpflows.update(flow, len(eth), header_len, ts, forward).packets
+                        flow_byte, flow_duration,max_duration,min_duration,sum_duration,average_duration,std_duration,idle_time,active_time = get_flow_info(self.tcpflows,flow)
                         #Calculates the no of packets for each flow vice -versa, and the total no. of bytes 
-                        src_to_dst_pkt, dst_to_src_pkt, src_to_dst_byte, dst_to_src_byte = get_src_dst_packets(tcpflows, flow)
-
-                    # calculate_incoming_connections(incoming_packets_src, incoming_packets_dst, src_port, dst_port, src_ip, dst_ip)
-                    if flow_duration != 0:
-                        rate = number_of_packets_per_trabsaction / flow_duration
-                        srate = src_to_dst_pkt / flow_duration
-                        drate = dst_to_src_pkt / flow_duration
-
-                    if dst_port_packet_count.get(dst_port):
-                        dst_port_packet_count[dst_port] = dst_port_packet_count[dst_port] + 1
+                        src_to_dst_pkt, dst_to_src_pkt, src_to_dst_byte, dst_to_src_byte = get_src_dst_packets(self.tcpflows, flow, forward)
+                        if ip.data.flags & dpkt.tcp.TH_RST:  # RST closes the flow
+                            self.tcpflows.evict(flow)
+                        elif ip.data.flags & dpkt.tcp.TH_FIN:  # closed once both sides sent a FIN
+                            self.tcpflows.add_fin(flow, forward, ts)
+
+                # calculate_incoming_connections(incoming_packets_src, incoming_packets_dst, src_port, dst_port, src_ip, dst_ip)
+                if flow_duration != 0:
+                    rate = number_of_packets_per_trabsaction / flow_duration
+                    srate = src_to_dst_pkt / flow_duration
+                    drate = dst_to_src_pkt / flow_duration
+
+                if "endpoint_counts" in stages:
+                    if self.dst_port_packet_count.get(dst_port):
+                        self.dst_port_packet_count[dst_port] = self.dst_port_packet_count[dst_port] + 1
                     else:
-                        dst_port_packet_count[dst_port] = 1
-
-
-
-
-
-
-
+                        self.dst_port_packet_count[dst_port] = 1
 
+                    # Average rate features (counted once the ports are known)
+                    proto_src_pkts = self.average_per_proto_src.add(protocol_name, src_ip)
+                    proto_dst_pkts = self.average_per_proto_dst.add(protocol_name, dst_ip)
+                    proto_src_port_pkts = self.average_per_proto_src_port.add(protocol_name, src_port)
+                    proto_dst_port_pkts = self.average_per_proto_dst_port.add(protocol_name, dst_port)
+                    #----end of Average rate features ---#
 
-                elif eth.type == dpkt.ethernet.ETH_TYPE_ARP:   # ARP packets
-                    # print("ARP packet")
-                    protocol_name = "ARP"
-                    arp = 1
-                    if packets_per_protocol.get(protocol_name):
-                        packets_per_protocol[protocol_name] = packets_per_protocol[protocol_name] + 1
-                    else:
-                        packets_per_protocol[protocol_name] = 1
 
 
-                    calculate_packets_counts_per_ips_proto(average_per_proto_src, protocol_name, src_ip, average_per_proto_dst,
-                                              dst_ip)
 
-                elif eth.type == dpkt.ieee80211:   # Wifi packets
-                    wifi_info = Communication_wifi(eth.data)
-                    type_info, sub_type_info, ds_status, src_mac, dst_mac, sequence, pack_id, fragments,wifi_dur = wifi_info.calculating()
-                    # print("Wifi related")
-                elif eth.type == dpkt.ethernet.ETH_TYPE_REVARP:  # RARP packets
-                    rarp = 1   # Reverce of ARP
 
-                # Average rate features
-                # for key in average_per_proto_src:
-                #     AR_P_Proto_P_SrcIP[key] = average_per_proto_src[key] / total_du
 
-                # for key in average_per_proto_dst:
-                #     AR_P_Proto_P_Dst_IP[key] = average_per_proto_dst[key] / total_du
 
-                # for key in average_per_proto_src_port:
-                #     ar_p_proto_p_src_sport[key] = average_per_proto_src_port[key] / total_du
 
-                # for key in average_per_proto_dst_port:
-                #     ar_p_proto_p_dst_dport[key] = average_per_proto_dst_port[key] / total_du
 
-                # end of average rate features
-                if len(flag_valus) == 0:
-                    for i in range(0,8):
-                        flag_valus.append(0)
-                
-                new_row = {
-                           'ts': ts,
-                           "Header_Length": header_len,
-                            "Protocol Type": proto_type, 
-                           "Time_To_Live": time_to_live,        
-                                  
-                            "Rate": 0,  
-                          
-                          "fin_flag_number": flag_valus[0],     
-                          "syn_flag_number":flag_valus[1],      
-                          "rst_flag_number":flag_valus[2],      
-                          "psh_flag_number": flag_valus[3],     
-                          "ack_flag_number": flag_valus[4],     
-                          "ece_flag_number":flag_valus[6],      
-                          "cwr_flag_number":flag_valus[7],      
-                        
-                           "ack_count":ack_count,               
-                           "syn_count":syn_count,               
-                           "fin_count": fin_count,                           
-                           "rst_count": rst_count,              
-                
-                           "HTTP": http,                           
-                           "HTTPS": https,                         
-                           "DNS": dns,                             
-                           "Telnet":telnet,                        
-                           "SMTP": smtp,                           
-                           "SSH": ssh,                             
-                           "IRC": irc,                             
-                           "TCP": tcp,                             
-                           "UDP": udp,                             
-                           "DHCP": dhcp,                           
-                           "ARP": arp,                             
-                           "ICMP": icmp,                           
-                           "IGMP": igmp,                           
-                           "IPv": ipv,                             
-                           "LLC": llc,                             
-
-                           "Tot sum": 0,                           #This value will be reassigned when writing the csv by using the Tot Size attribute 
-                           "Min": 0,                               
-                           "Max": 0,                               
-                           "AVG": 0,                               
-                           "Std": 0,                               
-                           "Tot size": ethernet_frame_size,         
-                           "IAT": IAT, 
-                           "Number": 1,                            #Number of packets
-
-                           "Variance":0,                           
-                          }
-                for c in base_row.keys():
-                    base_row[c].append(new_row[c])
-                    
-                count_rows+=1
-                
- 
-        processed_df = pd.DataFrame(base_row)
+            elif eth.type == dpkt.ethernet.ETH_TYPE_ARP:   # ARP packets
+                # print("ARP packet")
+                protocol_name = "ARP"
+                if "endpoint_counts" in self.stages:
+                    if self.packets_per_protocol.get(protocol_name):
+                        self.packets_per_protocol[protocol_name] = self.packets_per_protocol[protocol_name] + 1
+                    else:
+                        self.packets_per_protocol[protocol_name] = 1
+
+                    src_ip, dst_ip = getattr(eth.data, 'spa', 0), getattr(eth.data, 'tpa', 0)  # sender and target address
+                    proto_src_pkts = self.average_per_proto_src.add(protocol_name, src_ip)
+                    proto_dst_pkts = self.average_per_proto_dst.add(protocol_name, dst_ip)
+
+            elif eth.type == dpkt.ieee80211:   # Wifi packets
+                wifi_info = Communication_wifi(eth.data)
+                type_info, sub_type_info, ds_status, src_mac, dst_mac, sequence, pack_id, fragments,wifi_dur = wifi_info.calculating()
+                # print("Wifi related")
+            elif eth.type == dpkt.ethernet.ETH_TYPE_REVARP:  # RARP packets
+                rarp = 1   # Reverce of ARP
+
+            if len(flag_valus) == 0:
+                for i in range(0,8):
+                    flag_valus.append(0)
+            
+            row = (
+                       ts,                                     # ts
+                       header_len,                             # Header_Length
+                       proto_type,                             # Protocol Type
+                       time_to_live,                           # Time_To_Live
+                       0,                                      # Rate
+
+                       flag_valus[0],                          # fin_flag_number
+                       flag_valus[1],                          # syn_flag_number
+                       flag_valus[2],                          # rst_flag_number
+                       flag_valus[3],                          # psh_flag_number
+                       flag_valus[4],                          # ack_flag_number
+                       flag_valus[6],                          # ece_flag_number
+                       flag_valus[7],                          # cwr_flag_number
+
+                       ack_count,                              # ack_count
+                       syn_count,                              # syn_count
+                       fin_count,                              # fin_count
+                       rst_count,                              # rst_count
+
+                       *indicator_values(indicators),          # HTTP, HTTPS, DNS, Telnet, SMTP, SSH, IRC, TCP, UDP,
+                                                               # DHCP, ARP, ICMP, IGMP, IPv, LLC
+
+                       0,                                      # Tot sum, reassigned in the summary by using the Tot Size attribute
+                       0,                                      # Min
+                       0,                                      # Max
+                       0,                                      # AVG
+                       0,                                      # Std
+                       ethernet_frame_size,                    # Tot size
+                       IAT,                                    # IAT
+                       1,                                      # Number of packets
+                       0,                                      # Variance
+                   )
+            if not self.extra_columns:
+                return row
+            extra = {"flow_duration": flow_duration, "Srate": srate, "Drate": drate, "urg_count": urg_count,
+                     "Magnitue": magnite, "Radius": radius, "Correlation": correlation, "Covariance": covaraince,
+                     "Var_ratio": var_ratio, "Weight": weight}
+            # Average rate features: packets per protocol and endpoint per second of capture
+            if self.total_du != 0:
+                extra["AR_P_Proto_P_SrcIP"] = proto_src_pkts / self.total_du
+                extra["AR_P_Proto_P_Dst_IP"] = proto_dst_pkts / self.total_du
+                extra["ar_p_proto_p_src_sport"] = proto_src_port_pkts / self.total_du
+                extra["ar_p_proto_p_dst_dport"] = proto_dst_port_pkts / self.total_du
+            return row + tuple(extra.get(c, 0) for c in self.extra_columns)
+
+    def read_packets(self, ingestion, base_row, report):
+        """
+        the packet loop of pcap_evaluation with timers and counters (see Instrumentation.Extraction_report)
+        """
+        clock = report.clock
+        decode_time, packet_time = 0.0, 0.0
+        records = iter(ingestion)
+        while True:
+            start = clock()
+            record = next(records, None)  # read and decode
+            decoded = clock()
+            decode_time = decode_time + decoded - start
+            if record is None:
+                break
+            row = self.process_packet(*record)
+            if row is not None:
+                base_row.append(row)
+            packet_time = packet_time + clock() - decoded
+
+            eth = record[2]
+            report.count("packets")
+            if eth is None:
+                report.count("undecoded")
+            elif isinstance(eth, dpkt.ethernet.Ethernet):
+                report.count(f"eth_type_{eth.type:#06x}")
+            if row is None:
+                report.count("discarded")
+            if report.counters["packets"] % 1024 == 0:
+                report.maximum("open_flows", len(self.tcpflows) + len(self.udpflows))
+        report.count(f"linktype_{ingestion.linktype}", report.counters["packets"])
+        report.maximum("open_flows", len(self.tcpflows) + len(self.udpflows))
+        report.add_time("decode", decode_time)
+        report.add_time("packets", packet_time)
+
+    def pcap_evaluation(self,pcap_file,csv_file_name,output_format='csv',byte_range=None,time_range=None,
+                        record_offsets=None,keep_ts=False,report=None,engine='dpkt',window_sizes=(10,),
+                        window_step=None,time_windows=(),time_step=None,cache=None):
+        """
+        extracts the features of pcap_file (or of the records in byte_range / time_range / record_offsets of it)
+        into csv_file_name. keep_ts keeps the mean timestamp of every window, to merge partitions in time order.
+        report (Instrumentation.Extraction_report, opt-in) collects the time of every stage and packet/flow/output counters.
+        engine='batch' decodes the headers of all the records at once with NumPy (see Batch_decoder), it falls back
+        to the per-packet dpkt engine when the file or the requested columns need it.
+        Every size of window_sizes (packets per window) gives one output table from the same per-packet rows: the
+        first one is written to csv_file_name, the others to csv_file_name + '_w<size>' (see window_suffixes). The
+        windows are consecutive, or sliding windows starting every window_step packets if window_step is set.
+        Every duration of time_windows (seconds) gives one more table of the windows of that duration,
+        csv_file_name + '_t<duration>s', consecutive or sliding every time_step seconds.
+        cache (Extraction_cache, opt-in) returns the tables of an earlier extraction of the same bytes with the same
+        settings and extractor code instead of extracting them again (not used with on_flow_end).
+        :return: the number of rows of the first table (the rows of every table are kept in rows_written)
+        """
+        if self.on_flow_end is not None or hasattr(pcap_file, 'read'):
+            cache = None  # the callbacks would be skipped on a hit, a stream cannot be hashed beforehand
+        if cache is not None:
+            settings = {"features": self.features, "idle_timeout": self.idle_timeout,
+                        "active_timeout": self.active_timeout, "max_flows": self.max_flows,
+                        "block_size": self.block_size, "output_format": output_format, "keep_ts": keep_ts,
+                        "time_range": time_range, "window_sizes": window_sizes, "window_step": window_step,
+                        "time_windows": time_windows, "time_step": time_step}
+            key = cache.key(pcap_file, settings, byte_range, time_range, record_offsets)
+            rows_written = cache.get(key, csv_file_name, output_format)
+            if report is not None:
+                report.count("cache_hits" if rows_written is not None else "cache_misses")
+            if rows_written is not None:
+                self.rows_written = rows_written
+                return rows_written[next(iter(rows_written))]
+        self.reset()
+        base_row = Row_buffer(self.column_dtypes)  # per-packet rows, written in the order of columns
+        ingestion = Pcap_ingestion(pcap_file, byte_range, time_range, record_offsets)
+        batch = None
+        if engine == 'batch':
+            start = time.perf_counter()
+            batch = Batch_decoder.packet_rows(self, pcap_file, byte_range, time_range, record_offsets, report)
+            if batch is not None and report is not None:
+                report.add_time("batch", time.perf_counter() - start)
+                report.count("batch_rows", len(batch[1]))
+        elif engine != 'dpkt':
+            raise ValueError(f"unknown engine {engine!r}, expected 'dpkt' or 'batch'")
+        if batch is not None:
+            base_row = batch[1]
+        elif report is None:
+            for ts, buf, eth in ingestion:
+                row = self.process_packet(ts, buf, eth)
+                if row is not None:
+                    base_row.append(row)
+        else:
+            self.read_packets(ingestion, base_row, report)
+        if report is not None:
+            start = report.clock()
+        self.tcpflows.flush()
+        self.udpflows.flush()
+        if report is not None:
+            report.add_time("flows", report.clock() - start)
+            report.count("flows_closed", self.tcpflows.evicted + self.udpflows.evicted)
+            start = report.clock()
+
+        packets_df = base_row.to_frame()
+        del base_row
         # summary
-        last_row = 0
         #if(len(processed_df)%2==0):
          #   n_rows = 10
         #else: 
          #   n_rows = 15
-        n_rows = 10
-        df_summary_list = []
-        while last_row<len(processed_df):
-            #Get the first n_processed rows
-            sliced_df = processed_df[last_row:last_row+n_rows]
-            #Get the mode of the protocol type
-            sliced_df_protocol_type_mode = pd.DataFrame(sliced_df['Protocol Type'].mode())
-            sum_of_ack_count = (sliced_df["ack_count"].sum())
-            sum_of_syn_count = (sliced_df['syn_count'].sum())
-            sum_of_fin_count = (sliced_df['fin_count'].sum())
-            sum_of_rst_count = (sliced_df['rst_count'].sum())
-            total_sum_of_lengths = (sliced_df['Tot size'].sum())
-            min_packet_length = (sliced_df['Tot size'].min())
-            max_packet_length = (sliced_df['Tot size'].max())
-            mean_packet_length = (sliced_df['Tot size'].mean())
-            std_packet_length = (sliced_df['Tot size'].std())
-            variance_packet_lengths = (sliced_df['Tot size'].var())
-            #covariance_packet_lenghts = (sliced_df['Tot size'].cov())
-            num_of_packets = (sliced_df['Number'].sum())
-            duration_time_interval = (sliced_df['ts'].max() - sliced_df['ts'].min())
-
-            #print(sliced_df_protocol_type_mode)
-            #Get the mean of the tables
-            sliced_df = pd.DataFrame(sliced_df.mean()).T# mean
-            #replace the columns
-            sliced_df['Protocol Type'] = sliced_df_protocol_type_mode
-            sliced_df['ack_count'] = sum_of_ack_count
-            sliced_df['syn_count'] = sum_of_syn_count
-            sliced_df['fin_count'] = sum_of_fin_count
-            sliced_df['rst_count'] = sum_of_rst_count
-            sliced_df['Tot sum'] = total_sum_of_lengths
-            sliced_df['Min'] = min_packet_length
-            sliced_df['Max'] = max_packet_length
-            sliced_df['AVG'] = mean_packet_length
-            sliced_df['Std'] = std_packet_length
-            sliced_df['Number'] = num_of_packets
-            sliced_df['Rate'] = num_of_packets/duration_time_interval
-            sliced_df['Variance'] = variance_packet_lengths
-            #sliced_df['Covariance'] = covariance_packet_lenghts
-        
-
-            df_summary_list.append(sliced_df)
-            last_row += n_rows
-        processed_df = pd.concat(df_summary_list).reset_index(drop=True)
-        processed_df = processed_df.drop(columns = 'ts')
-        processed_df.to_csv(csv_file_name+".csv", index=False)
-        return True
-
+        self.rows_written = {}
+        outputs = window_suffixes(window_sizes, time_windows)
+        for suffix, (n_rows, duration) in outputs.items():
+            if n_rows is not None:
+                processed_df = summarize_windows(packets_df, n_rows, window_step)
+            else:
+                processed_df = summarize_time_windows(packets_df, duration, time_step)
+            processed_df = processed_df[(['ts'] if keep_ts else []) + self.features]
+            if report is not None:
+                report.add_time("summary", report.clock() - start)
+                start = report.clock()
+            # csv, parquet or arrow
+            path = write_table(processed_df, csv_file_name + suffix, output_format)
+            if report is not None:
+                report.add_time("write", report.clock() - start)
+                report.count("rows", len(processed_df))
+                report.count("bytes_written", os.path.getsize(path))
+                start = report.clock()
+            self.rows_written[suffix] = len(processed_df)
+        if cache is not None:
+            cache.put(key, csv_file_name, output_format, self.rows_written)
+        return self.rows_written[next(iter(outputs))]  # number of rows written
+
+    def stream_evaluation(self, stream, emit, n_rows=10, max_entries=100000):
+        """
+        Live extraction from a pcap stream (e.g. sys.stdin.buffer fed by tcpdump -w -, or a named pipe).
+        The summary row of every window of n_rows packets is passed to emit (a one-row DataFrame) as soon
+        as the window is complete, the last partial window when the stream ends. Only the packets of the
+        current window are kept, the per-endpoint tables are bounded by max_entries and the flow tables
+        by the timeouts and max_flows.
+        :return: the number of windows emitted
+        """
+        self.reset()
+        window = Row_buffer(self.column_dtypes, capacity=n_rows)
+        windows = 0
+        for ts, buf, eth in Pcap_ingestion(stream):
+            row = self.process_packet(ts, buf, eth)
+            if row is None:
+                continue
+            window.append(row)
+            if len(window) == n_rows:
+                emit(summarize_windows(window.to_frame(), n_rows)[self.features])
+                windows = windows + 1
+                window.clear()
+                self.trim_state(max_entries)
+        if len(window):
+            emit(summarize_windows(window.to_frame(), n_rows)[self.features])
+            windows = windows + 1
+        self.tcpflows.flush()
+        self.udpflows.flush()
+        return windows
+
+
+def window_suffixes(window_sizes=(10,), time_windows=()):
+    """
+    output file name suffixes of the summary tables, in the order they are written: '' for the first of
+    window_sizes (packets), '_w<size>' for the others and '_t<duration>s' for time_windows (seconds)
+    :return: {suffix: (packets, None) or (None, seconds)}
+    """
+    suffixes = {}
+    for n, n_rows in enumerate(window_sizes):
+        suffixes["" if n == 0 else f"_w{n_rows}"] = (n_rows, None)
+    for duration in time_windows:
+        suffixes[f"_t{duration:g}s"] = (None, duration)
+    if not suffixes:
+        raise ValueError("no window sizes or time windows")
+    return suffixes
+
+
+def csv_emitter(out):
+    """
+    returns an emit function for stream_evaluation that writes the windows to a csv file object (header first)
+    and flushes it after every window
+    """
+    state = {'header': True}
+
+    def emit(window_df):
+        window_df.to_csv(out, header=state['header'], index=False)
+        state['header'] = False
+        out.flush()
+
+    return emit
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(
+        description="Live feature extraction: reads a pcap stream and writes one summary row per window of packets."
+    )
+    parser.add_argument("input", nargs="?", default="-",
+                        help="pcap stream to read, a file or named pipe ('-' for stdin, e.g. tcpdump -w - | ...)")
+    parser.add_argument("--output", "-o", default="-", help="csv file to write the windows to ('-' for stdout)")
+    parser.add_argument("--window", "-n", type=int, default=10, help="number of packets per window (default: 10)")
+    parser.add_argument("--features", nargs="+", default=None,
+                        help="columns to write, in this order (default: all); the work no column needs is skipped")
+    parser.add_argument("--extra-columns", nargs="*", default=[], choices=list(Feature_extraction.optional_column_dtypes),
+                        help="opt-in columns appended to the output")
+    args = parser.parse_args()
+
+    stream = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    out = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+    try:
+        Feature_extraction(extra_columns=args.extra_columns, features=args.features).stream_evaluation(stream, csv_emitter(out), n_rows=args.window)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if out is not sys.stdout:
+            out.close()
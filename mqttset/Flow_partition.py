@@ -0,0 +1,50 @@
+import mmap
+import zlib
+
+import numpy as np
+
+from Pcap_index import RECORD_HEADER_LEN
+
+ETH_TYPE_IP = b'\x08\x00'
+ETH_TYPE_ARP = b'\x08\x06'
+IP_PROTO_TCP = 6
+IP_PROTO_UDP = 17
+
+
+def flow_hash(frame):
+    """
+    Symmetric hash of the flow of an Ethernet frame: both directions of a flow get the same value.
+    IPv4 frames are hashed on the sorted (ip, port) endpoints (the ports only for unfragmented
+    TCP/UDP), ARP frames on the sorted sender/target addresses, every other frame hashes to 0.
+    """
+    eth_type = frame[12:14]
+    if eth_type == ETH_TYPE_IP and len(frame) >= 34:
+        ihl = (frame[14] & 0x0f) * 4
+        src, dst = frame[26:30], frame[30:34]
+        fragmented = (frame[20] & 0x3f) or frame[21]
+        l4 = 14 + ihl
+        if frame[23] in (IP_PROTO_TCP, IP_PROTO_UDP) and not fragmented and len(frame) >= l4 + 4:
+            src = src + frame[l4:l4 + 2]
+            dst = dst + frame[l4 + 2:l4 + 4]
+    elif eth_type == ETH_TYPE_ARP and len(frame) >= 42:
+        src, dst = frame[28:32], frame[38:42]
+    else:
+        return 0
+    if src > dst:
+        src, dst = dst, src
+    return zlib.crc32(src + dst)  # crc32 is stable across processes, unlike hash()
+
+
+def partition_records(index, n_partitions):
+    """
+    assigns every record of an indexed pcap file to one of n_partitions by the hash of its flow
+    :return: list with the (sorted) record offsets of every partition
+    """
+    parts = np.zeros(len(index), dtype=np.int64)
+    with open(index.pcap_file, 'rb') as f:
+        if len(index):
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for i, (offset, caplen) in enumerate(zip(index.offsets.tolist(), index.caplen.tolist())):
+                    start = offset + RECORD_HEADER_LEN
+                    parts[i] = flow_hash(mm[start:start + min(caplen, 80)]) % n_partitions
+    return [index.offsets[parts == n] for n in range(n_partitions)]
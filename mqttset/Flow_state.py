@@ -0,0 +1,226 @@
+import math
+import socket
+from collections import OrderedDict
+
+ENDPOINT_BITS = 48  # 32 bit IPv4 address and 16 bit port
+ENDPOINT_MASK = (1 << ENDPOINT_BITS) - 1
+
+
+def flow_key(src_ip, src_port, dst_ip, dst_port):
+    """
+    canonical key of the flow between two (ip, port) endpoints: the raw 4 byte addresses and the
+    ports are packed into one int, the smaller endpoint first, so that both directions get the same key
+    """
+    src = int.from_bytes(src_ip, 'big') << 16 | src_port
+    dst = int.from_bytes(dst_ip, 'big') << 16 | dst_port
+    if src > dst:
+        src, dst = dst, src
+    return src << ENDPOINT_BITS | dst
+
+
+def is_forward(key, src_ip, src_port):
+    """
+    True if a packet from (src_ip, src_port) goes in the forward direction of the flow, i.e. from the
+    first endpoint of its key
+    """
+    return key >> ENDPOINT_BITS == int.from_bytes(src_ip, 'big') << 16 | src_port
+
+
+def flow_key_endpoints(key):
+    """
+    unpacks a flow key into its ((ip, port), (ip, port)) endpoints, ips as dotted strings (for the output only)
+    """
+    endpoints = []
+    for endpoint in (key >> ENDPOINT_BITS, key & ENDPOINT_MASK):
+        endpoints.append((socket.inet_ntoa((endpoint >> 16).to_bytes(4, 'big')), endpoint & 0xffff))
+    return tuple(endpoints)
+
+
+class Flow_state:
+    """
+    Running statistics of a single flow. Every packet is folded in with update() in O(1),
+    the timestamp mean/std are kept with Welford's algorithm. The packets and bytes of the forward
+    direction (see is_forward) are also counted, the backward ones are the rest. fin_flags records the
+    directions that sent a TCP FIN (1: forward, 2: backward).
+    """
+    __slots__ = ('packets', 'byte_count', 'forward_packets', 'forward_bytes', 'header_len', 'min_ts', 'max_ts',
+                 'prev_max_ts', 'sum_ts', 'mean_ts', 'm2_ts', 'fin_flags')
+
+    def __init__(self):
+        self.packets = 0
+        self.byte_count = 0
+        self.forward_packets = 0
+        self.forward_bytes = 0
+        self.header_len = 0
+        self.min_ts = 0
+        self.max_ts = 0
+        self.prev_max_ts = None  # second largest timestamp, used for the idle time
+        self.sum_ts = 0
+        self.mean_ts = 0.0
+        self.m2_ts = 0.0
+        self.fin_flags = 0
+
+    def update(self, byte_count, header_len, ts, forward=True):
+        self.packets = self.packets + 1
+        self.byte_count = self.byte_count + byte_count
+        if forward:
+            self.forward_packets = self.forward_packets + 1
+            self.forward_bytes = self.forward_bytes + byte_count
+        self.header_len = self.header_len + header_len
+        if self.packets == 1:
+            self.min_ts = ts
+            self.max_ts = ts
+        elif ts >= self.max_ts:
+            self.prev_max_ts = self.max_ts
+            self.max_ts = ts
+        else:
+            if self.prev_max_ts is None or ts > self.prev_max_ts:
+                self.prev_max_ts = ts
+            if ts < self.min_ts:
+                self.min_ts = ts
+        self.sum_ts = self.sum_ts + ts
+        delta = ts - self.mean_ts
+        self.mean_ts = self.mean_ts + delta / self.packets
+        self.m2_ts = self.m2_ts + delta * (ts - self.mean_ts)
+
+    def add_fin(self, forward=True):
+        """
+        records a FIN sent in the given direction
+        :return: True once both directions sent a FIN
+        """
+        self.fin_flags = self.fin_flags | (1 if forward else 2)
+        return self.fin_flags == 3
+
+    def direction_counts(self, forward=True):
+        """
+        :return: packets and bytes in the given direction, then in the opposite one
+        """
+        backward_packets = self.packets - self.forward_packets
+        backward_bytes = self.byte_count - self.forward_bytes
+        if forward:
+            return self.forward_packets, backward_packets, self.forward_bytes, backward_bytes
+        return backward_packets, self.forward_packets, backward_bytes, self.forward_bytes
+
+    def duration(self):
+        return self.max_ts - self.min_ts
+
+    def idle_time(self):
+        if self.packets > 1:
+            return self.max_ts - self.prev_max_ts
+        return self.max_ts
+
+    def active_time(self):
+        return self.duration()
+
+    def std_ts(self):
+        """
+        population standard deviation of the timestamps (same as np.std)
+        """
+        if self.packets == 0:
+            return 0.0
+        return math.sqrt(self.m2_ts / self.packets)
+
+
+class Flow_table:
+    """
+    Bounded table of the open flows (flow key -> Flow_state), kept in least recently seen order.
+    A flow is evicted when it has been idle for idle_timeout seconds, when it has been active for
+    more than active_timeout seconds, close_timeout seconds after it was closed (see close, the
+    last ACK of a TCP close still joins the flow) or, if the table holds max_flows flows, when it
+    is the least recently seen one. on_evict(key, state) is called once for every evicted flow
+    with its final statistics.
+    """
+    def __init__(self, idle_timeout=120, active_timeout=3600, max_flows=100000, on_evict=None, close_timeout=1):
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.max_flows = max_flows
+        self.on_evict = on_evict
+        self.close_timeout = close_timeout
+        self.flows = OrderedDict()
+        self.closing = OrderedDict()  # flow key -> timestamp of the close, in the order of the closes
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.flows)
+
+    def __contains__(self, key):
+        return key in self.flows
+
+    def __getitem__(self, key):
+        return self.flows[key]
+
+    def get(self, key, default=None):
+        return self.flows.get(key, default)
+
+    def update(self, key, byte_count, header_len, ts, forward=True):
+        """
+        folds a packet into its flow (a new flow is opened if needed) and expires the idle flows,
+        forward is the direction of the packet (see is_forward)
+        :return: the Flow_state of the packet's flow
+        """
+        state = self.flows.get(key)
+        if state is not None and (ts - state.max_ts > self.idle_timeout or ts - state.min_ts > self.active_timeout or
+                                  ts - self.closing.get(key, ts) > self.close_timeout):
+            self.evict(key)
+            state = None
+        if state is None:
+            state = Flow_state()
+            self.flows[key] = state
+            if len(self.flows) > self.max_flows:
+                self.evict(next(iter(self.flows)))
+        else:
+            self.flows.move_to_end(key)
+        state.update(byte_count, header_len, ts, forward)
+        self.expire(ts)
+        return state
+
+    def close(self, key, ts):
+        """
+        closes a flow at ts, it is evicted close_timeout seconds later
+        """
+        if key in self.flows and key not in self.closing:
+            self.closing[key] = ts
+
+    def add_fin(self, key, forward, ts):
+        """
+        records a TCP FIN of the flow, the flow is closed once both directions sent a FIN
+        """
+        state = self.flows.get(key)
+        if state is not None and state.add_fin(forward):
+            self.close(key, ts)
+
+    def expire(self, ts):
+        """
+        evicts the closed flows after close_timeout seconds and the flows without packets for
+        idle_timeout seconds (the oldest are first in the table)
+        """
+        while self.closing:
+            key, close_ts = next(iter(self.closing.items()))
+            if ts - close_ts <= self.close_timeout:
+                break
+            self.evict(key)
+        while self.flows:
+            key = next(iter(self.flows))
+            if ts - self.flows[key].max_ts <= self.idle_timeout:
+                break
+            self.evict(key)
+
+    def evict(self, key):
+        state = self.flows.pop(key, None)
+        self.closing.pop(key, None)
+        if state is None:
+            return
+        self.evicted = self.evicted + 1
+        if self.on_evict is not None:
+            self.on_evict(key, state)
+
+    def flush(self):
+        """
+        evicts all the open flows, at the end of a capture
+        """
+        while self.flows:
+            self.evict(next(iter(self.flows)))
+
+    def clear(self):
+        self.flows.clear()
+        self.closing.clear()
@@ -1,13 +1,40 @@
-from Feature_extraction import Feature_extraction
+from Extraction_cache import Extraction_cache
+from Feature_extraction import Feature_extraction, window_suffixes
+from Flow_partition import partition_records
+from Instrumentation import Extraction_report, aggregate_reports
+from Output_writer import Shard_merger, merge_by_timestamp, output_path
+from Pcap_index import Pcap_index
+from Pcap_ingestion import CAPTURE_SUFFIXES, file_format
+from Run_manifest import Run_manifest
 import time
 import warnings
 warnings.filterwarnings('ignore')
 import os
 from tqdm import tqdm
-from multiprocessing import Process
-import numpy as np
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
+import traceback
+import json
+
+
+def extract_shard(task):
+    """
+    pool task: extracts the features of one byte range (or flow partition) of a pcap file
+    :return: sequence number, output file stem, {output suffix: (output file, number of rows written)}, None or
+             the traceback of the failure, None or the report (stage times and counters) of the shard if instrument is set
+    """
+    seq, pcap_file, csv_file_name, output_format, options, extractor_options, instrument = task
+    report = Extraction_report() if instrument else None
+    try:
+        extractor = Feature_extraction(**extractor_options)
+        extractor.pcap_evaluation(pcap_file, csv_file_name, output_format, report=report, **options)
+        outputs = {suffix: (output_path(csv_file_name + suffix, output_format), rows)
+                   for suffix, rows in extractor.rows_written.items()}
+        return seq, csv_file_name, outputs, None, report.to_dict() if instrument else None
+    except Exception:
+        return seq, csv_file_name, {}, traceback.format_exc(), report.to_dict() if instrument else None
+
 
 if __name__ == '__main__':
 
@@ -23,73 +50,174 @@ if __name__ == '__main__':
         "PCAP/slowite.pcap",
     ]
     subfiles_size = 10  # MB
-    split_directory = 'split_temp/'
     destination_directory = 'output/'
     converted_csv_files_directory = 'csv_files/'
+    output_format = 'csv'  # 'csv', 'parquet' or 'arrow' (the last two need pyarrow)
     n_threads = 8
+    # 'size': byte ranges of subfiles_size MB (flows may be cut at the range boundaries)
+    # 'flow': n_threads partitions by a symmetric hash of the flow 5-tuple, every worker owns whole flows
+    partitioning = 'size'
+    # opt-in columns of Feature_extraction.optional_column_dtypes, e.g. ['AR_P_Proto_P_SrcIP', 'AR_P_Proto_P_Dst_IP']
+    extra_columns = []
+    # columns to write, e.g. only the ones the model uses (None: all); the work no written column needs is skipped
+    features = None
+    # per-stage timers and counters of every shard, aggregated into csv_files/<pcap>.report.json
+    instrument = False
+    # 'dpkt', or 'batch': the default columns decoded in NumPy batches (other columns and files fall back to dpkt)
+    engine = 'dpkt'
+    # packets per summary window, one output per size: csv_files/<pcap> for the first, csv_files/<pcap>_w<size>
+    # for the others (e.g. [10, 50, 200]), all from the same extraction pass
+    window_sizes = [10]
+    # None: consecutive windows, n: sliding windows starting every n packets
+    window_step = None
+    # durations (seconds) of time windows, one more output csv_files/<pcap>_t<duration>s each (e.g. [0.1, 1])
+    time_windows = []
+    # None: consecutive time windows, s: sliding time windows starting every s seconds
+    time_step = None
+    # directory of the extraction cache (None: no cache), shards of the same bytes extracted with the same settings
+    # and code are copied from it instead of extracted again; the least recently used entries beyond
+    # cache_size_gb are evicted
+    cache_directory = None
+    cache_size_gb = 20
     
     # Ensure directories exist
-    Path(split_directory).mkdir(parents=True, exist_ok=True)
     Path(destination_directory).mkdir(parents=True, exist_ok=True)
     Path(converted_csv_files_directory).mkdir(parents=True, exist_ok=True)
+    cache = None
+    if cache_directory is not None:
+        Path(cache_directory).mkdir(parents=True, exist_ok=True)
+        cache = Extraction_cache(cache_directory, int(cache_size_gb * 10 ** 9))
+    # progress of the run (pcap files and shards with their outputs, rows and checksums), a rerun skips the
+    # pcap files and shards that are done
+    manifest = Run_manifest(os.path.join(converted_csv_files_directory, 'manifest.json'))
+    # the settings that change the shards or their outputs, a pcap file done with other settings is redone
+    config = {"subfiles_size": subfiles_size, "partitioning": partitioning, "n_threads": n_threads,
+              "output_format": output_format, "extra_columns": list(extra_columns),
+              "features": None if features is None else list(features), "engine": engine,
+              "window_sizes": list(window_sizes), "window_step": window_step, "time_windows": list(time_windows),
+              "time_step": time_step}
 
+    # the workers are started once and kept for all the shards of all the pcap files, every free
+    # worker takes the next shard (the pool is started again after a worker died)
+    pool = ProcessPoolExecutor(n_threads)
     for i in range(len(pcapfiles)):
         lstart = time.time()
         pcap_file = pcapfiles[i]
         print(pcap_file)
-        print(">>>> 1. splitting the .pcap file.")
-        os.system('tcpdump -r '+ pcap_file +' -w ' + split_directory + 'split_temp -C ' + str(subfiles_size))
-        subfiles = os.listdir(split_directory)
+        if manifest.pcap_done(pcap_file, config):
+            print('done in a previous run, skipped')
+            continue
+        manifest.start_pcap(pcap_file, config)
+        print(">>>> 1. indexing the .pcap file and splitting it into byte ranges.")
+        # the records are scanned once (the index is kept next to the pcap), the workers read their
+        # byte range straight from the original file instead of a tcpdump -C copy of it
+        pcap_stem = Path(pcap_file).name  # e.g., 'bruteforce' from 'bruteforce.pcap' or 'bruteforce.pcap.gz'
+        for suffix in CAPTURE_SUFFIXES:
+            pcap_stem = pcap_stem.removesuffix(suffix)
+        if file_format(pcap_file) not in ('pcap', None):
+            # pcapng and compressed captures cannot be split, they are streamed by one worker
+            # (decompressed in a background thread, without a decompressed copy on disk)
+            subfiles = [{'keep_ts': True}] if partitioning == 'flow' else [{}]
+        elif partitioning == 'flow':
+            index = Pcap_index.load(pcap_file)
+            subfiles = [{'record_offsets': offsets, 'keep_ts': True} for offsets in partition_records(index, n_threads)]
+        else:
+            index = Pcap_index.load(pcap_file)
+            subfiles = [{'byte_range': byte_range} for byte_range in index.shards(subfiles_size * 1000000)]
         print(">>>> 2. Converting (sub) .pcap files to .csv files.")
-        processes = []
+        print(">>>> 3. Merging (sub) .csv files (summary).")
+        # Output paths inside csv_files/, using the PCAP stem as filename (one per window size / duration)
+        final_stem = os.path.join(converted_csv_files_directory, pcap_stem)
+        final_csv_paths = {suffix: output_path(final_stem + suffix, output_format)
+                           for suffix in window_suffixes(window_sizes, time_windows)}
+        # the sub files are appended in the order of the capture as soon as all the earlier ones are done, as
+        # they are (bytes, row groups or record batches) without parsing them
+        mergers = {suffix: Shard_merger(final_csv_path, output_format) for suffix, final_csv_path in
+                   final_csv_paths.items()} if partitioning != 'flow' else {}
         errors = 0
-        
-        subfiles_threadlist = np.array_split(subfiles, (len(subfiles)/n_threads)+1)
-        for f_list in tqdm(subfiles_threadlist):
-            n_processes = min(len(f_list), n_threads)
-            assert n_threads >= n_processes
-            assert n_threads >= len(f_list)
-            processes = []
-            for i in range(n_processes):
-                fe = Feature_extraction()
-                f = f_list[i]
-                subpcap_file = os.path.join(split_directory, f)
-                p = Process(target=fe.pcap_evaluation, args=(subpcap_file, os.path.join(destination_directory, f.split('.')[0])))
-                p.start()
-                processes.append(p)
-            for p in processes:
-                p.join()
-        print('The length of subfiles : ', len(subfiles))
-        print('The length of destination directory : ', len(os.listdir(destination_directory)))
-        print(">>>> 3. Removing (sub) .pcap files.")
-        for sf in subfiles:
+        csv_subfiles = {suffix: [] for suffix in final_csv_paths}
+        shard_reports = []
+        # the shards done in a previous run are merged as they are
+        done = {n: manifest.shard_done(pcap_file, n) for n in range(len(subfiles))}
+        done = {n: outputs for n, outputs in done.items() if outputs is not None}
+        for n, outputs in sorted(done.items()):
+            for suffix, (csv_file_path, rows) in outputs.items():
+                csv_subfiles[suffix].append(csv_file_path)
+                if mergers:
+                    mergers[suffix].add(n, csv_file_path, rows)
+        if done:
+            print(f'{len(done)} of {len(subfiles)} shards done in a previous run')
+        tasks = [(n, pcap_file, os.path.join(destination_directory, f"{pcap_stem}_{n:05d}"), output_format,
+                  dict(subfiles[n], engine=engine, window_sizes=window_sizes, window_step=window_step,
+                       time_windows=time_windows, time_step=time_step, cache=cache),
+                  {'extra_columns': extra_columns, 'features': features}, instrument)
+                 for n in range(len(subfiles)) if n not in done]
+        futures = {pool.submit(extract_shard, task): (task[0], task[2]) for task in tasks}  # -> shard number and stem
+        broken = False
+        for future in tqdm(as_completed(futures), total=len(futures)):
             try:
-                os.remove(os.path.join(split_directory, sf))
-            except:
-                pass
-
-        print(">>>> 4. Merging (sub) .csv files (summary).")
-        csv_subfiles = [f for f in os.listdir(destination_directory) if f.lower().endswith('.csv')]
-        # Output path inside csv_files/, using the PCAP stem as filename
-        pcap_stem = Path(pcap_file).stem  # e.g., 'bruteforce' from 'bruteforce.pcap'
-        final_csv_path = os.path.join(converted_csv_files_directory, f"{pcap_stem}.csv")
-        
-        mode = 'w'
-        for f in tqdm(csv_subfiles):
-            try:
-                d = pd.read_csv(os.path.join(destination_directory, f))
-                d.to_csv(final_csv_path, header=(mode=='w'), index=False, mode=mode)
-                mode='a'
-            except:
-                pass
+                n, shard_stem, outputs, error, report = future.result()
+            except BrokenProcessPool:
+                # a worker died (killed, e.g. out of memory, or crashed): its shard and all the pending ones fail
+                broken = True
+                n, shard_stem = futures[future]
+                outputs, error, report = {}, 'worker process died (killed or crashed)\n', None
+            if report is not None:
+                report.update({"shard": n, "file": shard_stem, "options": {k: str(v) for k, v in subfiles[n].items()
+                                                                           if k != 'record_offsets'}})
+                shard_reports.append(report)
+            if error is not None:
+                errors += 1
+                print(f'failed: {shard_stem}\n{error}')
+                manifest.fail_shard(pcap_file, n, error)
+                for merger in mergers.values():
+                    merger.skip(n)
+                continue
+            manifest.finish_shard(pcap_file, n, outputs)
+            for suffix, (csv_file_path, rows) in outputs.items():
+                csv_subfiles[suffix].append(csv_file_path)
+                if mergers:
+                    mergers[suffix].add(n, csv_file_path, rows)
+        if broken:
+            pool.shutdown(wait=False)
+            pool = ProcessPoolExecutor(n_threads)
+        final_rows = {}
+        for suffix, merger in mergers.items():
+            merger.close()
+            final_rows[suffix] = merger.rows
+            for csv_file_path, expected_rows, rows in merger.mismatches:
+                errors += 1
+                print(f'row count mismatch: {csv_file_path} reported {expected_rows} rows, {rows} were merged')
+        if not mergers:
+            # the windows of the flow partitions are interleaved again by their timestamp
+            for suffix, final_csv_path in final_csv_paths.items():
+                final_rows[suffix] = merge_by_timestamp(sorted(csv_subfiles[suffix]), final_csv_path, output_format)
+        print('The length of subfiles : ', len(subfiles))
+        if instrument:
+            summary = aggregate_reports(shard_reports)
+            summary.update({"pcap_file": pcap_file, "seconds": time.time() - lstart, "workers": n_threads,
+                            "subfiles_size_mb": subfiles_size, "partitioning": partitioning, "errors": errors,
+                            "per_shard": sorted(shard_reports, key=lambda report: report["shard"])})
+            report_path = os.path.join(converted_csv_files_directory, f"{pcap_stem}.report.json")
+            with open(report_path, 'w') as f:
+                json.dump(summary, f, indent=2)
+            print(f'report: {report_path} ({summary["counters"].get("packets", 0)} packets, slowest shard '
+                  f'{summary["slowest_shard_seconds"]:.2f}s)')
 
-        print(">>>> 5. Removing (sub) .csv files.")
-        for cf in tqdm(csv_subfiles):
+        if errors:
+            # the sub files are kept for the rerun, which redoes only the failed shards
+            print(f'done with errors! ({pcap_file})(' + str(round(time.time()-lstart, 2))+ 's),  total_errors= '+str(errors))
+            continue
+        manifest.finish_pcap(pcap_file, {suffix: (path, final_rows[suffix]) for suffix, path in final_csv_paths.items()
+                                         if os.path.exists(path)})
+        print(">>>> 4. Removing (sub) .csv files.")
+        for cf in tqdm([cf for files in csv_subfiles.values() for cf in files]):
             try:
-                os.remove(os.path.join(destination_directory, cf))
-            except:
-                pass
+                os.remove(cf)
+            except OSError as e:
+                print(f'could not remove {cf}: {e}')
         print(f'done! ({pcap_file})(' + str(round(time.time()-lstart, 2))+ 's),  total_errors= '+str(errors))
         
+    pool.shutdown()
     end = time.time()
     print(f'Elapsed Time = {(end-start)}s')
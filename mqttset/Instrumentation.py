@@ -0,0 +1,54 @@
+import json
+import time
+from collections import Counter
+
+
+class Extraction_report:
+    """
+    Opt-in timers and counters of one extraction (shard). Stage times are accumulated in seconds,
+    counters are summed and maxima (e.g. the peak number of open flows) keep their largest value.
+    """
+    clock = staticmethod(time.perf_counter)
+
+    def __init__(self):
+        self.times = {}
+        self.counters = Counter()
+        self.maxima = {}
+
+    def add_time(self, stage, seconds):
+        self.times[stage] = self.times.get(stage, 0.0) + seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters[name] + n
+
+    def maximum(self, name, value):
+        if value > self.maxima.get(name, value - 1):
+            self.maxima[name] = value
+
+    def to_dict(self):
+        return {"times": dict(self.times), "counters": dict(self.counters), "maxima": dict(self.maxima)}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def aggregate_reports(reports):
+    """
+    sums the times and counters of several reports (dicts of Extraction_report.to_dict) and keeps the largest maxima
+    :return: the aggregated report, with the number of shards and the slowest shard time
+    """
+    total = Extraction_report()
+    slowest = 0.0
+    for report in reports:
+        for stage, seconds in report["times"].items():
+            total.add_time(stage, seconds)
+        for name, n in report["counters"].items():
+            total.count(name, n)
+        for name, value in report["maxima"].items():
+            total.maximum(name, value)
+        slowest = max(slowest, sum(report["times"].values()))
+    summary = total.to_dict()
+    summary["shards"] = len(reports)
+    summary["slowest_shard_seconds"] = slowest
+    return summary
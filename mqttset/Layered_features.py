@@ -107,9 +107,70 @@ class L1:
         self.packet = packet
 
     def LLC(self):
-        if type(self.packet == dpkt.llc):
+        if isinstance(self.packet, dpkt.llc.LLC):
             return 1
         else:
             return 0
     def MAC(self):
-        return dpkt.ethernet.Ethernet.__flags__
\ No newline at end of file
+        return dpkt.ethernet.Ethernet.__flags__
+
+
+# Table driven classification: every indicator is one bit of a mask, in the order of the
+# HTTP ... LLC columns of Feature_extraction, followed by the indicators that are not written.
+INDICATORS = ["HTTP", "HTTPS", "DNS", "Telnet", "SMTP", "SSH", "IRC", "TCP", "UDP", "DHCP", "ARP", "ICMP", "IGMP",
+              "IPv", "LLC", "MQTT", "CoAP"]
+BITS = {name: 1 << n for n, name in enumerate(INDICATORS)}
+N_COLUMNS = INDICATORS.index("LLC") + 1  # indicators that are written
+
+IP_PROTO_TCP = 6
+IP_PROTO_UDP = 17
+
+# ethernet type -> indicators. LLC is set for every IPv4 frame, as in the CICIoT2023 extractor
+# (whose L1.LLC was always true), so that the datasets can be combined.
+ETHERNET_TYPES = {dpkt.ethernet.ETH_TYPE_IP: BITS["IPv"] | BITS["LLC"], dpkt.ethernet.ETH_TYPE_ARP: BITS["ARP"]}
+# ip protocol number -> indicators (TCP and UDP only count when the transport header was decoded)
+IP_PROTOCOLS = {1: BITS["ICMP"], 2: BITS["IGMP"]}
+TRANSPORTS = {IP_PROTO_TCP: BITS["TCP"], IP_PROTO_UDP: BITS["UDP"]}
+# transport -> {port: indicators}, a port matches as source or as destination
+PORTS = {
+    IP_PROTO_TCP: {80: BITS["HTTP"], 443: BITS["HTTPS"], 23: BITS["Telnet"], 25: BITS["SMTP"], 22: BITS["SSH"],
+                   21: BITS["IRC"], 1883: BITS["MQTT"], 5683: BITS["CoAP"]},
+    IP_PROTO_UDP: {53: BITS["DNS"], 5683: BITS["CoAP"]},
+}
+# transport -> {(source port, destination port): indicators}
+PORT_PAIRS = {
+    IP_PROTO_TCP: {},
+    IP_PROTO_UDP: {(67, 68): BITS["DHCP"], (68, 67): BITS["DHCP"]},
+}
+
+
+def add_port(transport, port, name):
+    """
+    registers a new port -> indicator rule, e.g. add_port(IP_PROTO_TCP, 8883, "MQTT")
+    """
+    PORTS[transport][port] = PORTS[transport].get(port, 0) | BITS[name]
+
+
+def classify(ip_proto, transport=False, src_port=0, dst_port=0):
+    """
+    indicator mask of an ip packet, transport tells if its TCP/UDP header was decoded
+    """
+    mask = IP_PROTOCOLS.get(ip_proto, 0)
+    if transport and ip_proto in TRANSPORTS:
+        ports = PORTS[ip_proto]
+        mask = mask | TRANSPORTS[ip_proto] | ports.get(src_port, 0) | ports.get(dst_port, 0) \
+            | PORT_PAIRS[ip_proto].get((src_port, dst_port), 0)
+    return mask
+
+
+INDICATOR_VALUES = {}  # mask -> tuple of the written indicators
+
+
+def indicator_values(mask):
+    """
+    the written indicators (HTTP ... LLC) of a mask as a tuple of 0/1
+    """
+    values = INDICATOR_VALUES.get(mask)
+    if values is None:
+        values = INDICATOR_VALUES[mask] = tuple((mask >> n) & 1 for n in range(N_COLUMNS))
+    return values
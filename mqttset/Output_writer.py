@@ -0,0 +1,170 @@
+import pandas as pd
+
+from Window_summary import INTEGER_COLUMNS
+
+# file extension of every output format
+OUTPUT_FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+
+
+def output_path(file_stem, output_format='csv'):
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"unknown output format {output_format!r}, expected one of {list(OUTPUT_FORMATS)}")
+    return file_stem + OUTPUT_FORMATS[output_format]
+
+
+def table_schema(columns):
+    """
+    explicit Arrow schema of a summary table: int64 for the counts, sums and lengths, float64 otherwise
+    """
+    import pyarrow as pa
+    return pa.schema([(c, pa.int64() if c in INTEGER_COLUMNS else pa.float64()) for c in columns])
+
+
+def write_table(df, file_stem, output_format='csv'):
+    """
+    writes a summary table as csv, parquet or Arrow IPC file, returns the path of the written file
+    """
+    path = output_path(file_stem, output_format)
+    if output_format == 'csv':
+        df.to_csv(path, index=False)
+        return path
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pa.Table.from_pandas(df.astype({c: 'int64' for c in df.columns if c in INTEGER_COLUMNS}),
+                                 schema=table_schema(df.columns), preserve_index=False)
+    if output_format == 'parquet':
+        pq.write_table(table, path)
+    else:
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    return path
+
+
+def read_table(path, output_format='csv'):
+    if output_format == 'csv':
+        return pd.read_csv(path)
+    if output_format == 'parquet':
+        return pd.read_parquet(path)
+    import pyarrow as pa
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_pandas()
+
+
+def merge_by_timestamp(paths, final_path, output_format='csv'):
+    """
+    merges tables that were written with their 'ts' column (flow partitions) into one table ordered by
+    timestamp, the 'ts' column is dropped. Returns the number of rows written.
+    """
+    tables = [read_table(path, output_format) for path in paths]
+    if not tables:
+        return 0
+    merged = pd.concat(tables, ignore_index=True).sort_values('ts', kind='stable')
+    merged = merged.drop(columns='ts').reset_index(drop=True)
+    write_table(merged, final_path[:-len(OUTPUT_FORMATS[output_format])], output_format)
+    return len(merged)
+
+
+class Shard_merger:
+    """
+    Appends shard files to final_path in the order of their sequence number, as soon as all the shards
+    before them are done, so that merging overlaps with the extraction of the later shards. The files
+    are not parsed: csv files are copied byte by byte (keeping the header of the first file only),
+    parquet row groups and Arrow record batches are copied as they are. The rows appended from every
+    shard are checked against the number of rows the shard reported.
+    """
+    def __init__(self, final_path, output_format='csv'):
+        output_path('', output_format)  # checks the format
+        self.final_path = final_path
+        self.output_format = output_format
+        self.next_seq = 0
+        self.pending = {}   # seq -> (path, expected rows), None for a failed shard
+        self.rows = 0
+        self.mismatches = []    # (path, expected rows, appended rows)
+        self.writer = None
+
+    def add(self, seq, path, expected_rows=None):
+        self.pending[seq] = (path, expected_rows)
+        self.flush()
+
+    def skip(self, seq):
+        """
+        marks a shard that will never arrive (failed), so that the following shards are not held back
+        """
+        self.pending[seq] = None
+        self.flush()
+
+    def flush(self):
+        while self.next_seq in self.pending:
+            shard = self.pending.pop(self.next_seq)
+            self.next_seq = self.next_seq + 1
+            if shard is None:
+                continue
+            path, expected_rows = shard
+            rows = self.append(path)
+            self.rows = self.rows + rows
+            if expected_rows is not None and rows != expected_rows:
+                self.mismatches.append((path, expected_rows, rows))
+
+    def append(self, path):
+        if self.output_format == 'csv':
+            return self.append_csv(path)
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        rows = 0
+        if self.output_format == 'parquet':
+            pf = pq.ParquetFile(path)
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.final_path, pf.schema_arrow)
+            for i in range(pf.num_row_groups):
+                group = pf.read_row_group(i)
+                self.writer.write_table(group)
+                rows = rows + group.num_rows
+        else:
+            with pa.memory_map(path) as source:
+                reader = pa.ipc.open_file(source)
+                if self.writer is None:
+                    self.writer = pa.ipc.new_file(self.final_path, reader.schema)
+                for i in range(reader.num_record_batches):
+                    batch = reader.get_batch(i)
+                    self.writer.write_batch(batch)
+                    rows = rows + batch.num_rows
+        return rows
+
+    def append_csv(self, path):
+        rows = 0
+        with open(path, 'rb') as f:
+            header = f.readline()
+            if self.writer is None:
+                self.writer = open(self.final_path, 'wb')
+                self.writer.write(header)
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                self.writer.write(chunk)
+                rows = rows + chunk.count(b'\n')
+        return rows
+
+    def close(self):
+        """
+        closes the merged file, shards that are still pending (a gap in the sequence) are appended in order
+        """
+        for seq in sorted(self.pending):
+            self.next_seq = seq
+            self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def merge_tables(paths, final_path, output_format='csv'):
+    """
+    appends the given files into final_path in the given order, without parsing them
+    :return: the number of rows written
+    """
+    merger = Shard_merger(final_path, output_format)
+    try:
+        for seq, path in enumerate(paths):
+            merger.add(seq, path)
+    finally:
+        merger.close()
+    return merger.rows
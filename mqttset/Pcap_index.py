@@ -0,0 +1,169 @@
+import mmap
+import os
+import struct
+import tempfile
+import zipfile
+from array import array
+
+import numpy as np
+
+from Run_manifest import file_mode
+
+FILE_HEADER_LEN = 24
+RECORD_HEADER_LEN = 16
+# magic number -> (byte order, divisor of the sub-second timestamp field)
+PCAP_MAGICS = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1E6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1E6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1E9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1E9),
+}
+
+
+def read_file_header(buf):
+    """
+    parses the global header of a pcap file
+    :return: byte order, timestamp divisor, snaplen, link type
+    """
+    magic = bytes(buf[:4])
+    if magic not in PCAP_MAGICS:
+        raise ValueError('invalid tcpdump header')
+    endian, divisor = PCAP_MAGICS[magic]
+    snaplen, linktype = struct.unpack_from(endian + 'II', buf, 16)
+    return endian, divisor, snaplen, linktype
+
+
+def scan_records(buf, endian, divisor):
+    """
+    walks the record headers of a pcap file, a truncated last record is left out
+    :return: offsets, timestamps and captured lengths of the records
+    """
+    record_header = struct.Struct(endian + 'IIII')
+    offsets, secs, fracs, caplens = array('Q'), array('I'), array('I'), array('I')
+    pos = FILE_HEADER_LEN
+    size = len(buf)
+    while pos + RECORD_HEADER_LEN <= size:
+        sec, frac, caplen, _ = record_header.unpack_from(buf, pos)
+        if pos + RECORD_HEADER_LEN + caplen > size:
+            break
+        offsets.append(pos)
+        secs.append(sec)
+        fracs.append(frac)
+        caplens.append(caplen)
+        pos = pos + RECORD_HEADER_LEN + caplen
+    ts = np.frombuffer(secs, dtype=np.uint32) + np.frombuffer(fracs, dtype=np.uint32) / divisor
+    return np.frombuffer(offsets, dtype=np.uint64), ts, np.frombuffer(caplens, dtype=np.uint32)
+
+
+class Pcap_index:
+    """
+    Offsets, timestamps and captured lengths of every record of a pcap file. It is built with one
+    scan of the record headers over an mmap and kept in a sidecar file (<pcap>.idx.npz), so that
+    workers can be handed byte ranges of the original capture instead of split copies of it.
+    """
+    def __init__(self, pcap_file, offsets, ts, caplen, linktype, file_size, file_mtime):
+        self.pcap_file = pcap_file
+        self.offsets = offsets
+        self.ts = ts
+        self.caplen = caplen
+        self.linktype = linktype
+        self.file_size = file_size
+        self.file_mtime = file_mtime
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @staticmethod
+    def sidecar_path(pcap_file):
+        return pcap_file + '.idx.npz'
+
+    @classmethod
+    def build(cls, pcap_file):
+        stat = os.stat(pcap_file)
+        with open(pcap_file, 'rb') as f:
+            if stat.st_size == 0:
+                raise ValueError('invalid tcpdump header')
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                endian, divisor, _, linktype = read_file_header(mm)
+                offsets, ts, caplen = scan_records(mm, endian, divisor)
+        return cls(pcap_file, offsets, ts, caplen, linktype, stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def load(cls, pcap_file, save=True):
+        """
+        loads the sidecar index of pcap_file, the index is (re)built if it is missing, stale or unreadable
+        """
+        stat = os.stat(pcap_file)
+        path = cls.sidecar_path(pcap_file)
+        if os.path.exists(path):
+            try:
+                with np.load(path) as sidecar:
+                    file_size, file_mtime, linktype = (int(v) for v in sidecar['meta'])
+                    if file_size == stat.st_size and file_mtime == stat.st_mtime_ns:
+                        return cls(pcap_file, sidecar['offsets'], sidecar['ts'], sidecar['caplen'], linktype,
+                                   file_size, file_mtime)
+            except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile):  # truncated or not an index
+                pass
+        index = cls.build(pcap_file)
+        if save:
+            index.save()
+        return index
+
+    def save(self):
+        """
+        writes the sidecar index to a temp file in the same directory, then atomically replaces the sidecar
+        with it (as Run_manifest.atomic_write_json), so that a crash never leaves half a sidecar. The index
+        is only a cache: it is not saved if the directory is not writable.
+        """
+        path = self.sidecar_path(self.pcap_file)
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=".index_tmp_", suffix=".npz", dir=os.path.dirname(path) or '.')
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:  # a file object, np.savez would append .npz to a name
+                np.savez(f, offsets=self.offsets, ts=self.ts, caplen=self.caplen,
+                         meta=np.array([self.file_size, self.file_mtime, self.linktype], dtype=np.int64))
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, file_mode(path))  # not the owner only mode of the temp file
+            os.replace(tmp_path, path)
+        except BaseException as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if not isinstance(e, OSError):
+                raise
+
+    def record_range(self, first, last):
+        """
+        byte range [start, end) covering the records first..last-1
+        """
+        if first >= last:
+            return FILE_HEADER_LEN, FILE_HEADER_LEN
+        end = int(self.offsets[last - 1]) + RECORD_HEADER_LEN + int(self.caplen[last - 1])
+        return int(self.offsets[first]), end
+
+    def shards(self, shard_size):
+        """
+        cuts the capture into record aligned byte ranges of about shard_size bytes (like tcpdump -C)
+        """
+        if len(self) == 0:
+            return []
+        ends = self.offsets + RECORD_HEADER_LEN + self.caplen - FILE_HEADER_LEN
+        cuts = np.searchsorted(ends, np.arange(shard_size, int(ends[-1]), shard_size), side='left') + 1
+        bounds = np.unique(np.concatenate([[0], cuts, [len(self)]]))
+        return [self.record_range(first, last) for first, last in zip(bounds[:-1], bounds[1:])]
+
+    def time_range(self, start_ts, end_ts):
+        """
+        byte range of the records with start_ts <= ts < end_ts. If the capture is not in timestamp
+        order the range covers the first to the last matching record (filter on ts when reading).
+        """
+        ts = self.ts
+        if len(ts) == 0 or np.all(ts[1:] >= ts[:-1]):
+            first, last = np.searchsorted(ts, start_ts, 'left'), np.searchsorted(ts, end_ts, 'left')
+            return self.record_range(int(first), int(last))
+        matches = np.flatnonzero((ts >= start_ts) & (ts < end_ts))
+        if len(matches) == 0:
+            return self.record_range(0, 0)
+        return self.record_range(int(matches[0]), int(matches[-1]) + 1)
@@ -0,0 +1,251 @@
+import gzip
+import io
+import lzma
+import queue
+import threading
+
+import dpkt
+
+from Pcap_index import Pcap_index, PCAP_MAGICS
+
+# link types that dpkt cannot decode and that are handed to scapy instead
+BLUETOOTH_LINKTYPES = (187, 201, 251, 254, 256)
+ZIGBEE_LINKTYPES = (195, 215, 230)
+SCAPY_LINKTYPES = BLUETOOTH_LINKTYPES + ZIGBEE_LINKTYPES
+# first bytes of the capture formats other than pcap
+PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+COMPRESSION_MAGICS = {b'\x1f\x8b': 'gzip', b'\xfd7zXZ\x00': 'xz', b'\x28\xb5\x2f\xfd': 'zstd'}
+# file name suffixes of the captures, removed from the end of a name in this order to get its stem
+CAPTURE_SUFFIXES = ('.gz', '.xz', '.zst', '.pcapng', '.pcap')
+
+
+def decode_ethernet(buf):
+    """
+    decodes an Ethernet frame, returns None if the frame is not readable by dpkt
+    """
+    try:
+        return dpkt.ethernet.Ethernet(buf)
+    except Exception:
+        return None
+
+
+def scapy_decoder(linktype):
+    """
+    returns the scapy layer class for a bluetooth/zigbee link type, scapy is only imported here
+    """
+    from scapy.config import conf
+    if linktype in BLUETOOTH_LINKTYPES:
+        import scapy.layers.bluetooth
+        import scapy.layers.bluetooth4LE
+    else:
+        import scapy.layers.dot15d4
+        import scapy.layers.zigbee
+    layer = conf.l2types.get(linktype)
+
+    def decode(buf):
+        try:
+            return layer(buf)
+        except Exception:
+            return None
+
+    return decode
+
+
+def capture_format(header):
+    """
+    the format of a capture from its first (6) bytes: 'pcap', 'pcapng', 'gzip', 'xz', 'zstd' or None if unknown
+    """
+    header = bytes(header)
+    if header[:4] in PCAP_MAGICS:
+        return 'pcap'
+    if header[:4] == PCAPNG_MAGIC:
+        return 'pcapng'
+    for magic, compression in COMPRESSION_MAGICS.items():
+        if header.startswith(magic):
+            return compression
+    return None
+
+
+def file_format(pcap_file):
+    """
+    capture_format of a capture file
+    """
+    with open(pcap_file, 'rb') as f:
+        return capture_format(f.read(6))
+
+
+def decompressing_reader(stream, compression):
+    """
+    file object of the decompressed bytes of a gzip/xz/zstd stream (concatenated members/frames included),
+    zstandard is only imported here
+    """
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if compression == 'xz':
+        return lzma.LZMAFile(stream, mode='rb')
+    import zstandard
+    return zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+
+
+class Background_reader(io.RawIOBase):
+    """
+    Reads a stream in a background thread, chunk_size bytes at a time and at most max_chunks ahead of
+    the consumer, so that the reading (e.g. the decompression, which releases the GIL) overlaps with
+    the processing of the bytes already read. Closing it stops the thread and closes the stream.
+    """
+    def __init__(self, stream, chunk_size=1 << 20, max_chunks=8):
+        super().__init__()
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(max_chunks)
+        self.chunk = memoryview(b'')
+        self.eof = False
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.fill, daemon=True)
+        self.thread.start()
+
+    def fill(self):
+        try:
+            while not self.stop.is_set():
+                chunk = self.stream.read(self.chunk_size)
+                self.chunks.put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:  # raised again in the consumer thread
+            self.chunks.put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.chunk and not self.eof:
+            chunk = self.chunks.get()
+            if isinstance(chunk, Exception):
+                self.eof = True
+                raise chunk
+            self.eof = not chunk
+            self.chunk = memoryview(chunk)
+        n = min(len(b), len(self.chunk))
+        b[:n] = self.chunk[:n]
+        self.chunk = self.chunk[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.stop.set()
+            while self.thread.is_alive():  # unblocks the thread if it waits for a free slot
+                try:
+                    self.chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self.stream.close()
+        super().close()
+
+
+def open_stream(stream):
+    """
+    wraps an open binary stream for capture_reader: compressed streams are decompressed by a
+    Background_reader thread
+    :return: a buffered stream of the (decompressed) capture
+    """
+    if not hasattr(stream, 'peek'):
+        stream = io.BufferedReader(stream)
+    compression = capture_format(stream.peek(6)[:6])
+    if compression in COMPRESSION_MAGICS.values():
+        stream = io.BufferedReader(Background_reader(decompressing_reader(stream, compression)))
+    return stream
+
+
+def capture_reader(stream):
+    """
+    dpkt reader (yielding (ts, buf)) of a pcap or pcapng stream opened by open_stream
+    """
+    if capture_format(stream.peek(4)[:4]) == 'pcapng':
+        return dpkt.pcapng.Reader(stream)
+    return dpkt.pcap.Reader(stream)
+
+
+class Pcap_ingestion:
+    """
+    Reads a pcap file (or an open pcap stream) once, record by record, and decodes every record with the decoder of the
+    file's link type. Only the current record is held in memory. Timestamps are floats (dpkt gives Decimals for
+    nanosecond pcaps, which do not mix with the float statistics of the flows).
+    byte_range=(start, end) limits the reading to the records in that range of the original file
+    (see Pcap_index.shards), time_range=(start_ts, end_ts) to the records with start_ts <= ts < end_ts,
+    which are located with the sidecar index of the file. record_offsets reads only the records
+    at the given offsets (see Flow_partition.partition_records).
+    pcapng and gzip/xz/zstd compressed captures (files or streams) are read as streams from start to end,
+    decompressed in a background thread; only time_range applies to them.
+    """
+    def __init__(self, pcap_file, byte_range=None, time_range=None, record_offsets=None):
+        self.pcap_file = pcap_file
+        self.byte_range = byte_range
+        self.time_range = time_range
+        self.record_offsets = record_offsets
+        self.linktype = None
+
+    def get_decoder(self, linktype):
+        if linktype in SCAPY_LINKTYPES:
+            return scapy_decoder(linktype)
+        # Ethernet, and every link type without a dedicated decoder (as before)
+        return decode_ethernet
+
+    def records(self, f, pcap):
+        """
+        yields the (ts, buf) records of the byte/time range
+        """
+        if self.record_offsets is not None:
+            for offset in self.record_offsets:
+                f.seek(int(offset))
+                for ts, buf in pcap:  # reads the record at the current position of the file
+                    yield ts, buf
+                    break
+            return
+        byte_range = self.byte_range
+        if byte_range is None and self.time_range is not None:
+            byte_range = Pcap_index.load(self.pcap_file).time_range(*self.time_range)
+        if byte_range is None:
+            yield from pcap
+            return
+        start, end = byte_range
+        f.seek(start)  # the reader continues from the current position of the file
+        if start >= end:
+            return
+        for ts, buf in pcap:
+            if self.time_range is None or self.time_range[0] <= ts < self.time_range[1]:
+                yield ts, buf
+            if f.tell() >= end:
+                break
+
+    def stream_records(self, stream):
+        """
+        yields (ts, buf, frame) of the records of a stream opened by open_stream, within time_range
+        """
+        pcap = capture_reader(stream)
+        self.linktype = pcap.datalink()
+        decode = self.get_decoder(self.linktype)
+        for ts, buf in pcap:
+            ts = float(ts)
+            if self.time_range is None or self.time_range[0] <= ts < self.time_range[1]:
+                yield ts, buf, decode(buf)
+
+    def __iter__(self):
+        """
+        yields (ts, buf, frame), frame is None if the record could not be decoded
+        """
+        if hasattr(self.pcap_file, 'read'):
+            # an already open stream (stdin, named pipe): read from start to end
+            yield from self.stream_records(open_stream(self.pcap_file))
+            return
+        if file_format(self.pcap_file) not in ('pcap', None):
+            if self.byte_range is not None or self.record_offsets is not None:
+                raise ValueError(f"{self.pcap_file}: byte ranges and record offsets need an uncompressed pcap file")
+            with open(self.pcap_file, 'rb') as f, open_stream(f) as stream:
+                yield from self.stream_records(stream)
+            return
+        with open(self.pcap_file, 'rb') as f:
+            pcap = dpkt.pcap.Reader(f)
+            self.linktype = pcap.datalink()
+            decode = self.get_decoder(self.linktype)
+            for ts, buf in self.records(f, pcap):
+                yield float(ts), buf, decode(buf)
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+
+class Row_buffer:
+    """
+    Preallocated column store for the per-packet rows. Every column has a fixed dtype, rows are
+    written straight into a NumPy structured array that doubles its capacity when it is full.
+    """
+    def __init__(self, column_dtypes, capacity=4096):
+        self.dtype = np.dtype(list(column_dtypes.items()))
+        self.data = np.zeros(capacity, dtype=self.dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, row):
+        """
+        appends one row, given as a tuple in column order
+        """
+        if self.size == len(self.data):
+            self.grow()
+        self.data[self.size] = row
+        self.size = self.size + 1
+
+    def grow(self):
+        data = np.zeros(max(2 * len(self.data), 1), dtype=self.dtype)
+        data[:self.size] = self.data[:self.size]
+        self.data = data
+
+    def clear(self):
+        self.size = 0
+
+    def to_frame(self):
+        """
+        returns the rows written so far as a DataFrame with the column dtypes of the buffer
+        """
+        rows = self.data[:self.size]
+        return pd.DataFrame({c: rows[c] for c in self.dtype.names})
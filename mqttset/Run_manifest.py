@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import stat
+import tempfile
+
+
+def file_checksum(path):
+    """
+    sha256 of a file, read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_mode(path):
+    """
+    permission bits for a new content of path: those of path if it exists, otherwise those of a new file
+    (0o666 without the umask), as the temp files of mkstemp are only readable by their owner
+    """
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def atomic_write_json(path, data):
+    """
+    writes data as json to a temp file in the same directory, then atomically replaces path with it, so that
+    path always holds either the previous or the new content
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=".manifest_tmp_", suffix=".json", dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, file_mode(path))
+        os.replace(tmp_path, path)  # atomic overwrite on most OSes
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def pcap_fingerprint(pcap_file):
+    stat = os.stat(pcap_file)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def output_record(path, rows):
+    return {"path": path, "rows": rows, "size": os.path.getsize(path), "sha256": file_checksum(path)}
+
+
+def outputs_intact(outputs):
+    """
+    True if every recorded output file still exists with its recorded size and checksum
+    """
+    for output in outputs.values():
+        if not os.path.exists(output["path"]) or os.path.getsize(output["path"]) != output["size"]:
+            return False
+        if file_checksum(output["path"]) != output["sha256"]:
+            return False
+    return True
+
+
+class Run_manifest:
+    """
+    Durable progress of a Generating_dataset run: the status of every pcap file and of each of its shards,
+    with their output files, row counts and checksums. The manifest is rewritten atomically after every
+    change, so a run that dies leaves the last consistent state, and a rerun skips the pcap files and
+    shards whose outputs are intact. A pcap file is started over if it or the extraction config changed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.pcaps = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.pcaps = json.load(f)["pcaps"]
+
+    def save(self):
+        atomic_write_json(self.path, {"version": 1, "pcaps": self.pcaps})
+
+    def entry(self, pcap_file, config):
+        """
+        the entry of pcap_file if it was recorded for the same file and config, otherwise None
+        """
+        entry = self.pcaps.get(pcap_file)
+        if entry is None or entry["fingerprint"] != pcap_fingerprint(pcap_file) or entry["config"] != config:
+            return None
+        return entry
+
+    def pcap_done(self, pcap_file, config):
+        entry = self.entry(pcap_file, config)
+        return entry is not None and entry["status"] == "done" and outputs_intact(entry["outputs"])
+
+    def start_pcap(self, pcap_file, config):
+        """
+        records pcap_file as running, its finished shards are kept if the file and config did not change
+        """
+        entry = self.entry(pcap_file, config)
+        if entry is None:
+            entry = {"fingerprint": pcap_fingerprint(pcap_file), "config": config, "shards": {}}
+            self.pcaps[pcap_file] = entry
+        entry.update({"status": "running", "outputs": {}})
+        self.save()
+
+    def shard_done(self, pcap_file, seq):
+        """
+        :return: {suffix: (output file, rows)} of a finished shard whose outputs are intact, otherwise None
+        """
+        shard = self.pcaps[pcap_file]["shards"].get(str(seq))
+        if shard is None or shard["status"] != "done" or not outputs_intact(shard["outputs"]):
+            return None
+        return {suffix: (output["path"], output["rows"]) for suffix, output in shard["outputs"].items()}
+
+    def finish_shard(self, pcap_file, seq, outputs):
+        """
+        records a finished shard, outputs is {suffix: (output file, rows)}
+        """
+        self.pcaps[pcap_file]["shards"][str(seq)] = {
+            "status": "done", "outputs": {suffix: output_record(path, rows) for suffix, (path, rows) in outputs.items()}}
+        self.save()
+
+    def fail_shard(self, pcap_file, seq, error):
+        self.pcaps[pcap_file]["shards"][str(seq)] = {"status": "failed", "error": error, "outputs": {}}
+        self.save()
+
+    def finish_pcap(self, pcap_file, outputs):
+        """
+        records a merged pcap file, outputs is {suffix: (output file, rows)}; the shard entries are dropped
+        """
+        entry = self.pcaps[pcap_file]
+        entry.update({"status": "done", "shards": {},
+                      "outputs": {suffix: output_record(path, rows) for suffix, (path, rows) in outputs.items()}})
+        self.save()
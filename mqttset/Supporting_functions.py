@@ -1,6 +1,5 @@
 import socket
 import struct
-from functools import reduce
 import numpy as np
 
 def ip_to_str(ip):
@@ -34,28 +33,13 @@ def get_protocol_name(protocol_val):
 
 def get_flow_info(flows, flow):
     """
-    generating flow features
+    generating flow features from the running statistics of the flow (Flow_state)
     """
+    state = flows[flow]
+    duration = state.duration()
 
-    bytes = reduce(lambda x, y: x+y,
-                   map(lambda e: e['byte_count'], flows[flow]))
-    duration = sorted(map(lambda e: e['ts'], flows[flow]))
-    if len(duration)>1:
-        idle_time = duration[len(duration)-1] - duration[len(duration) - 2]
-    else:
-        idle_time = duration[len(duration)-1]
-
-    max_duration = max(duration)
-    min_duration = min(duration)
-    sum_duration = sum(duration)
-    average_duration = sum(duration) / len(duration)
-    std_duration = np.std(duration)
-    duration = duration[-1] - duration[0]
-    active_time = duration
-
-    #print('header length : ' , bytes) 
-
-    return bytes,duration,max_duration,min_duration,sum_duration,average_duration,std_duration,idle_time,active_time
+    return state.byte_count, duration, state.max_ts, state.min_ts, state.sum_ts, state.mean_ts, state.std_ts(), \
+        state.idle_time(), state.active_time()
 
 def get_flag_values(tcp):
     """
@@ -103,33 +87,18 @@ def compare_flow_flags(flag_valus,ack_count,syn_count,fin_count,urg_count,rst_co
 
     return ack_count,syn_count,fin_count,urg_count,rst_count
 
-def get_src_dst_packets(flows,flow):
+def get_src_dst_packets(flows,flow,forward):
     """
     calculating the number of packets from source_destination and vice-versa
-    :param flows:
-    :param flow:
+    :param flows: flow key -> Flow_state
+    :param flow: flow key (see Flow_state.flow_key)
+    :param forward: direction of the current packet in the flow (see Flow_state.is_forward)
     :return: src_to_dst_pkt,dst_to_src_pkt,src_to_dst_byte, dst_to_src_byte
     """
-    src_to_dst_pkt = 0
-    dst_to_src_pkt = 0
-    src_to_dst_byte = 0
-    dst_to_src_byte = 0
-    if flows.get(flow):
-        packets = flows[flow]
-        src_to_dst_pkt = len(packets)
-        for i in range(0,len(packets)):
-            src_to_dst_byte = src_to_dst_byte + packets[i]['byte_count']
-
-
-    newflow = (flow[1], flow[0])
-    if flows.get(newflow):
-        packets = flows[newflow]
-        dst_to_src_pkt = len(packets)
-        for i in range(0, len(packets)):
-            dst_to_src_byte = dst_to_src_byte + packets[i]['byte_count']
-
-
-    return src_to_dst_pkt, dst_to_src_pkt, src_to_dst_byte, dst_to_src_byte
+    state = flows.get(flow)
+    if state is None:
+        return 0, 0, 0, 0
+    return state.direction_counts(forward)
 
 def calculate_incoming_connections(src_pkt, dst_pkt, src_port,dst_port,src_ip,dst_ip):
     """
@@ -192,7 +161,7 @@ def calculate_packets_count_per_ports_proto(average_per_proto_src_port,average_p
 
     if average_per_proto_dst_port.get(str((protocol_name, dst_port))):
         average_per_proto_dst_port[str((protocol_name, dst_port))] = average_per_proto_dst_port[
-            str((protocol_name, dst_port))]
+            str((protocol_name, dst_port))] + 1
 
     else:
         average_per_proto_dst_port[str((protocol_name, dst_port))] = 1
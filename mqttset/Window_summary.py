@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+
+# per-window columns that are summed instead of averaged (urg_count only when it is extracted)
+SUM_COLUMNS = ["ack_count", "syn_count", "fin_count", "rst_count", "Number", "urg_count"]
+# summary columns that hold whole numbers, every other summary column is a float
+INTEGER_COLUMNS = ["Protocol Type", "Tot sum", "Min", "Max"] + SUM_COLUMNS
+# largest (windows x rows) matrix of row indices summarized at once, it bounds the memory of long or overlapping windows
+MAX_BLOCK_SIZE = 1 << 22
+
+
+def count_windows(n_packets, n_rows):
+    """
+    returns the [start, end) row bounds of consecutive windows of n_rows packets
+    """
+    starts = np.arange(0, n_packets, n_rows, dtype=np.intp)
+    ends = np.minimum(starts + n_rows, n_packets)
+    return starts, ends
+
+
+def sliding_windows(n_packets, n_rows, step=1):
+    """
+    returns the [start, end) row bounds of the windows of n_rows packets starting every step packets,
+    only whole windows (a single window of all the packets if there are fewer than n_rows)
+    """
+    starts = np.arange(0, max(n_packets - n_rows, 0) + 1, step, dtype=np.intp)
+    ends = np.minimum(starts + n_rows, n_packets)
+    return starts, ends
+
+
+def time_windows(ts, duration, step=None):
+    """
+    returns the [start, end) row bounds of the windows of duration seconds that hold packets: consecutive
+    windows aligned to multiples of duration (since the epoch), or sliding windows starting at every
+    multiple of step seconds. A packet with an earlier timestamp than a packet before it counts as sent
+    at the latest timestamp so far, so that every window is a range of rows.
+    """
+    ts = np.maximum.accumulate(ts) if len(ts) else np.asarray(ts, dtype=np.float64)
+    if step is None:
+        window = np.floor(ts / duration)
+        starts = np.flatnonzero(np.r_[True, window[1:] != window[:-1]]) if len(ts) else np.zeros(0, dtype=np.intp)
+        ends = np.r_[starts[1:], len(ts)].astype(np.intp)
+        return starts, ends
+    # the windows that can hold a packet start from duration before it to the step of the packet (one more
+    # step on both sides for the rounding of the bounds): the range [b - ceil(duration / step), b + 1] of
+    # window numbers for the packets of step b. The overlapping ranges are merged before they are expanded,
+    # so that the work is proportional to the number of windows.
+    if len(ts) == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    first = np.unique(np.floor(ts / step).astype(np.int64))
+    low, high = first - int(np.ceil(duration / step)), first + 1
+    new_range = np.r_[True, low[1:] > high[:-1] + 1]
+    low, high = low[new_range], high[np.r_[new_range[1:], True]]
+    lengths = high - low + 1
+    offsets = np.cumsum(lengths) - lengths
+    windows = np.arange(lengths.sum(), dtype=np.int64) + np.repeat(low - offsets, lengths)
+    bounds = windows * step
+    return np.searchsorted(ts, bounds), np.searchsorted(ts, bounds + duration)
+
+
+def summarize_block(columns, block_rows):
+    """
+    Summarizes windows that all have the same number of rows. block_rows is a (windows x rows)
+    matrix of row indices, every reduction runs along axis 1 so it gives the same result as the
+    reduction of a single window.
+    """
+    length = block_rows.shape[1]
+    summary = {}
+    for c, values in columns.items():
+        summary[c] = values[block_rows].sum(axis=1, dtype=np.float64) / length
+
+    protocol_type = columns["Protocol Type"][block_rows]
+    uniques = np.unique(protocol_type)
+    counts = (protocol_type[:, :, None] == uniques).sum(axis=1)
+    summary["Protocol Type"] = uniques[counts.argmax(axis=1)]  # smallest value on ties, as Series.mode()
+    for c in SUM_COLUMNS:
+        if c in columns:
+            summary[c] = columns[c][block_rows].sum(axis=1)
+
+    sizes = columns["Tot size"][block_rows]
+    mean_size = summary["Tot size"]
+    if length > 1:
+        variance = ((mean_size[:, None] - sizes) ** 2).sum(axis=1, dtype=np.float64) / (length - 1)
+    else:
+        variance = np.full(len(sizes), np.nan)
+    summary["Tot sum"] = sizes.sum(axis=1)
+    summary["Min"] = sizes.min(axis=1)
+    summary["Max"] = sizes.max(axis=1)
+    summary["AVG"] = mean_size
+    summary["Std"] = np.sqrt(variance)
+    summary["Variance"] = variance
+
+    ts = columns["ts"][block_rows]
+    duration = ts.max(axis=1) - ts.min(axis=1)
+    with np.errstate(divide='ignore'):
+        summary["Rate"] = summary["Number"] / duration
+    return summary
+
+
+def summarize(processed_df, starts, ends):
+    """
+    Summarizes the packets of every [start, end) window into one row: the mean of every column,
+    the mode of the protocol type, the sums of the flag counts and packets, the statistics of the
+    packet lengths and the rate. Windows may overlap, empty windows are dropped.
+    """
+    lengths = ends - starts
+    keep = lengths > 0
+    starts, lengths = starts[keep], lengths[keep]
+    columns = {c: processed_df[c].to_numpy() for c in processed_df.columns}
+    if len(starts) == 0:
+        return pd.DataFrame({c: values[:0] for c, values in columns.items()})
+
+    summary = {}
+    for length in np.unique(lengths):
+        same_length = np.flatnonzero(lengths == length)
+        chunk = max(1, MAX_BLOCK_SIZE // length)
+        for first in range(0, len(same_length), chunk):
+            windows = same_length[first:first + chunk]
+            block_rows = starts[windows, None] + np.arange(length)
+            for c, values in summarize_block(columns, block_rows).items():
+                if c not in summary:
+                    summary[c] = np.empty(len(starts), dtype=values.dtype)
+                summary[c][windows] = values
+    return pd.DataFrame(summary, columns=processed_df.columns)
+
+
+def summarize_windows(processed_df, n_rows=10, step=None):
+    """
+    summary of consecutive windows of n_rows packets, or of sliding windows starting every step packets
+    """
+    if step is None:
+        starts, ends = count_windows(len(processed_df), n_rows)
+    else:
+        starts, ends = sliding_windows(len(processed_df), n_rows, step)
+    return summarize(processed_df, starts, ends)
+
+
+def summarize_time_windows(processed_df, duration, step=None):
+    """
+    summary of consecutive windows of duration seconds, or of sliding windows starting every step seconds
+    (the windows without packets are left out)
+    """
+    starts, ends = time_windows(processed_df["ts"].to_numpy(), duration, step)
+    return summarize(processed_df, starts, ends)